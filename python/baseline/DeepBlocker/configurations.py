@@ -1,3 +1,4 @@
+STATIC_MODEL_DIR = "models/"
 FASTTEXT_EMBEDDIG_PATH = "models/fasttext/wiki.en.bin"
 #Dimension of the word embeddings.
 EMB_DIMENSION_SIZE = 300
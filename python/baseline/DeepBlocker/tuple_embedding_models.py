@@ -7,11 +7,11 @@ import numpy as np
 from sklearn.decomposition import TruncatedSVD
 import torch 
 
-import fasttext  
 from torchtext.data import get_tokenizer
 
 import dl_models
 from configurations import *
+from static_models import load_fasttext, WordVectors
 
 #This is the Abstract Base Class for all Tuple Embedding models
 class ABCTupleEmbedding:
@@ -41,7 +41,8 @@ class AverageEmbedding(ABCTupleEmbedding):
         super().__init__()
         print("Loading FastText model")
 
-        self.word_embedding_model = fasttext.load_model(FASTTEXT_EMBEDDIG_PATH)
+        #Memory-mapped, so that concurrent runs share one copy of the vectors
+        self.word_embedding_model = WordVectors(load_fasttext(STATIC_MODEL_DIR, FASTTEXT_EMBEDDIG_PATH))
         self.dimension_size = EMB_DIMENSION_SIZE
 
         self.tokenizer = get_tokenizer("basic_english")
@@ -83,7 +84,8 @@ class SIFEmbedding(ABCTupleEmbedding):
         super().__init__()
         print("Loading FastText model")
 
-        self.word_embedding_model = fasttext.load_model(FASTTEXT_EMBEDDIG_PATH)
+        #Memory-mapped, so that concurrent runs share one copy of the vectors
+        self.word_embedding_model = WordVectors(load_fasttext(STATIC_MODEL_DIR, FASTTEXT_EMBEDDIG_PATH))
         self.dimension_size = EMB_DIMENSION_SIZE
 
         self.tokenizer = get_tokenizer("basic_english")
@@ -0,0 +1,195 @@
+import os
+import json
+from time import time
+import numpy as np
+from quantization import QuantizedVectors, float_rows
+from reduction import sample_vectors
+
+
+# faiss.IndexHNSWFlat, hnswlib, faiss.IndexHNSWSQ over 8-bit or fp16 codes,
+# and a faiss IVF-PQ index, optionally OPQ-rotated
+KINDS = ['hnsw', 'hnswlib', 'hnsw_sq8', 'hnsw_fp16', 'ivfpq']
+
+
+def index_kind(storage, gpu=True):
+    """Returns the index for a store: float16 and int8 ones are indexed on their codes."""
+    if storage == 'float32':
+        return 'hnsw' if gpu else 'hnswlib'
+    return 'hnsw_sq8' if storage == 'int8' else 'hnsw_fp16'
+
+
+def index_path(prefix, kind, params):
+    """Returns the file of the `kind` index with `params` built on the store at `prefix`."""
+    tag = '_'.join(f'{name}{value}' for name, value in sorted(params.items()))
+    return f'{prefix}.{kind}_{tag}.index'
+
+
+def ivfpq_params(num_elements, dim, nlist=None, m=None, nbits=8, opq=False, train_size=None):
+    """
+    Returns the parameters of an IVF-PQ index over `num_elements` vectors:
+    `nlist` inverted lists (4 sqrt(n) by default), codes of `m` sub-quantizers
+    of `nbits` bits, so m * nbits / 8 bytes per vector, and the size of the
+    training sample (39 vectors per list, as faiss asks for). `m` falls back
+    to the largest divisor of `dim` not above it (dim / 8 by default).
+    """
+    nlist = nlist or max(1, int(4 * np.sqrt(num_elements)))
+    m = min(m or max(1, dim // 8), dim)
+    while dim % m:
+        m -= 1
+    train_size = min(num_elements, train_size or max(39 * nlist, 39 * 2**nbits))
+    return {'nlist': nlist, 'm': m, 'nbits': nbits, 'opq': opq, 'train_size': train_size}
+
+
+def build_ivfpq(vectors, params, batch_size=5000):
+    """
+    Trains an IVF-PQ index on a sample of `vectors` and adds all of them,
+    read `batch_size` rows at a time, so only the sample is held as float32.
+    """
+    import faiss
+    num_elements, dim = vectors.shape
+    pq = 'IVF{},PQ{}x{}'.format(params['nlist'], params['m'], params['nbits'])
+    if params['opq']:
+        pq = 'OPQ{},{}'.format(params['m'], pq)
+    index = faiss.index_factory(dim, pq)
+    index.train(sample_vectors([vectors], params['train_size']))
+    for i in range(0, num_elements, batch_size):
+        index.add(float_rows(vectors, i, i+batch_size))
+    return index
+
+
+def build_index(vectors, kind, params, batch_size=5000):
+    """
+    Builds a `kind` index over `vectors`, added `batch_size` rows at a time,
+    with the HNSW `params` M and ef_construction, or those of ivfpq_params.
+    """
+    if kind == 'ivfpq':
+        return build_ivfpq(vectors, params, batch_size)
+    num_elements, dim = vectors.shape
+    M, ef_construction = params['M'], params['ef_construction']
+    if kind == 'hnswlib':
+        import hnswlib
+        index = hnswlib.Index(space = 'l2', dim = dim)
+        index.init_index(max_elements = num_elements, ef_construction = ef_construction, M = M)
+        for i in range(0, num_elements, batch_size):
+            index.add_items(float_rows(vectors, i, i+batch_size), np.arange(i, min(i+batch_size, num_elements)))
+        return index
+
+    import faiss
+    if kind == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, M)
+    elif kind == 'hnsw_sq8':
+        if not isinstance(vectors, QuantizedVectors):
+            raise ValueError('hnsw_sq8 indexes the codes of an int8 store')
+        # The graph keeps the 8-bit codes of the store with its own vmin and vdiff
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, M)
+        storage = faiss.downcast_index(index.storage)
+        faiss.copy_array_to_vector(np.concatenate([vectors.vmin, vectors.vdiff]),
+                                   storage.sq.trained)
+        storage.is_trained = True
+        index.is_trained = True
+    elif kind == 'hnsw_fp16':
+        index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, M)
+        index.train(float_rows(vectors, 0, batch_size))
+    else:
+        raise ValueError(f'Unknown index: {kind}')
+    index.hnsw.efConstruction = ef_construction
+    # Dequantized rows are encoded back to the same codes
+    for i in range(0, num_elements, batch_size):
+        index.add(float_rows(vectors, i, i+batch_size))
+    return index
+
+
+def save_index(index, kind, path):
+    if kind == 'hnswlib':
+        index.save_index(path + '.tmp')
+    else:
+        import faiss
+        faiss.write_index(index, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def read_index(kind, path, dim):
+    if kind == 'hnswlib':
+        import hnswlib
+        index = hnswlib.Index(space = 'l2', dim = dim)
+        index.load_index(path)
+        return index
+    import faiss
+    return faiss.read_index(path)
+
+
+def get_index(prefix, source, kind, params, vectors, batch_size=5000):
+    """
+    Returns (index, build time, loaded): the `kind` index over `vectors` saved
+    by an earlier run for the same `source`, a digest of the store and of any
+    transform applied to it, and the same `params`, or a newly built and saved
+    one. The build time of a loaded index is the one recorded when it was built.
+    """
+    path = index_path(prefix, kind, params)
+    key = {'source': source, 'kind': kind, 'params': params,
+           'rows': len(vectors), 'dimensions': vectors.shape[1]}
+    if os.path.exists(path) and os.path.exists(path + '.json'):
+        with open(path + '.json') as f:
+            meta = json.loads(f.read())
+        if meta.get('key') == key:
+            return read_index(kind, path, vectors.shape[1]), meta['build_time'], True
+
+    t1 = time()
+    index = build_index(vectors, kind, params, batch_size)
+    build_time = time() - t1
+    save_index(index, kind, path)
+    with open(path + '.json', 'w') as f:
+        f.write(json.dumps({'key': key, 'build_time': build_time}))
+    return index, build_time, False
+
+
+def index_bytes(prefix, kind, params):
+    """Returns the size of a saved index, close to the memory it takes once loaded."""
+    return os.path.getsize(index_path(prefix, kind, params))
+
+
+def search_index(index, kind, queries, k, ef_search=50, batch_size=5000, nprobe=16):
+    """
+    Returns the (len(queries) x k) labels of the k nearest indexed rows to
+    every query. HNSW graphs are searched with `ef_search`, IVF indexes scan
+    the `nprobe` lists nearest to each query.
+    """
+    if kind == 'hnswlib':
+        index.set_ef(max(ef_search, k))
+    elif kind == 'ivfpq':
+        import faiss
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    else:
+        index.hnsw.efSearch = ef_search
+    labels = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(0, len(queries), batch_size):
+        rows = float_rows(queries, i, i+batch_size)
+        if kind == 'hnswlib':
+            labels[i:i+len(rows)], _ = index.knn_query(rows, k = k)
+        else:
+            _, labels[i:i+len(rows)] = index.search(rows, k=k)
+    return labels
+
+
+def rerank(queries, base, labels, k, batch_size=256):
+    """
+    Re-orders the shortlist `labels` of every query by its exact Euclidean
+    distance to the rows of `base`, read from the store only for the ids in a
+    batch's shortlists, and returns the k nearest. Missing (-1) labels go last.
+    """
+    reranked = np.empty((len(labels), k), dtype=np.int64)
+    for i in range(0, len(labels), batch_size):
+        shortlist = labels[i:i+batch_size]
+        x = float_rows(queries, i, i+batch_size)
+        ids = np.unique(shortlist[shortlist >= 0])
+        if len(ids) == 0:
+            reranked[i:i+len(x)] = shortlist[:, :k]
+            continue
+        rows = np.asarray(base[ids], dtype=np.float32)
+        candidates = rows[np.searchsorted(ids, np.maximum(shortlist, 0))]
+        candidates -= x[:, None, :]
+        dists = np.einsum('ijk,ijk->ij', candidates, candidates)
+        dists[shortlist < 0] = np.inf
+        order = np.argsort(dists, axis=1, kind='stable')[:, :k]
+        reranked[i:i+len(x)] = np.take_along_axis(shortlist, order, axis=1)
+    return reranked
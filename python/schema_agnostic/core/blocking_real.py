@@ -1,85 +1,22 @@
 import os
 import pandas as pd
-import torch
-from scipy.spatial.distance import cdist
 from time import time
-import faiss
-import hnswlib
-import numpy as np
 import sys
 from utils import cases, vectorizers
+from embedding_store import load_embeddings, storage_path, store_digest
+from reduction import get_reduction, parse_reductions
+from knn import exact_knn
+from candidates import CandidatePairs, sweep
+from ann_index import get_index, index_kind, search_index
 
 
 
-def topk(x, k):
-    out = []
-    for no, xx in enumerate(x):
-        out.append((no, xx))
-    out = sorted(out, key=lambda x: x[1])
-    return out[:k]
-
 def find_exact_nns(tensor1, tensor2, k, gpu=False):
-    if gpu:
-        tensor11 = torch.Tensor(tensor1).cuda()
-        tensor22 = torch.Tensor(tensor2).cuda()
-        
-        dists = torch.cdist(tensor11, tensor22, p=2)
-
-        topk_dists = torch.topk(dists, k, largest=False)
-        results = []
-        for no, res_list in enumerate(topk_dists.indices):
-            for res in res_list:
-                results.append((no, res.item()))
-        results = set(results)
-        return results
-    else:
-        dists = cdist(tensor1, tensor2)
-        results = []
-        for no, dist_list in enumerate(dists):
-            for res in topk(dist_list, k):
-                results.append((no, res[0]))
-        results = set(results)
-        return results
+    indices, _ = exact_knn(tensor1, tensor2, k, gpu)
+    return indices
     
-def find_approx_nns(tensor1, tensor2, k, gpu=False):
-    num_elements, dim = tensor2.shape
-
-    if gpu:
-        tensor11 = np.float32(tensor1.copy(order='C'))
-        tensor22 = np.float32(tensor2.copy(order='C'))
-
-        index = faiss.IndexHNSWFlat(dim, 16)
-        index.hnsw.efConstruction = 200
-        index.add(tensor22)  # build the index
-        index.hnsw.efSearch = 50
-        distances, labels = index.search(tensor11, k=k)
-
-        results = []
-        for no, label_list in enumerate(labels):
-            for res in label_list:
-                results.append((no, res))
-        results = set(results)
-        return results
-    else:
-        p = hnswlib.Index(space = 'l2', dim = dim)
-        p.init_index(max_elements = num_elements, ef_construction = 200, M = 16)
-        p.add_items(tensor2)
-        p.set_ef(50)
-        labels, distances = p.knn_query(tensor1, k = k)
-    
-        results = []
-        for no, label_list in enumerate(labels):
-            for res in label_list:
-                results.append((no, res))
-        results = set(results)
-        return results
-
-
-def calc_recall(true, preds):
-    return len(true & preds) / len(true)
-
-def calc_precision(true, preds):
-    return len(true & preds) / len(preds)
+def find_approx_nns(index, kind, tensor1, k):
+    return search_index(index, kind, tensor1, k)
 
 
 # # Start NNS euclidean - Real
@@ -89,8 +26,16 @@ data_dir = sys.argv[1]
 emb_dir = sys.argv[2]
 log_file = sys.argv[3] + 'blocking_euclidean_real.csv'
 ks = [1, 5, 10]
+# float32 always runs first, as the baseline of the recall deltas
+storages = ['float32'] + (sys.argv[sys.argv.index('--storage')+1].split(',') if '--storage' in sys.argv else [])
+# e.g. --reduce pca:64,rp:128, each run after the full-dimensional vectors
+reductions = [None] + parse_reductions(sys.argv)
 
 gpu = True
+# Also block with an HNSW graph over the first collection, saved next to its
+# store and reused across k values and runs
+approx = '--approx' in sys.argv
+hnsw_params = {'M': 16, 'ef_construction': 200}
 
 scores2 = []
 
@@ -103,61 +48,68 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
     
     ground_file = '{}/{}/{}.csv'.format(data_dir, dir, ground_file)
     ground_df = pd.read_csv(ground_file, sep=sep)
-    ground_results = set(ground_df.apply(lambda x: (x[0], x[1]), axis=1).values)
+    ground_results = CandidatePairs.from_ground_truth(ground_df)
     
     for nocol, (col1, col2) in enumerate(cols):
         if nocol != 2:
             continue
-        for vec in vectorizers:
-            file1 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data1, col1, vec)
-            file2 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data2, col2, vec)
+        for vec, storage, reduction in [(vec, storage, reduction) for vec in vectorizers
+                                        for storage in storages for reduction in reductions]:
+            file1 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data1, col1, vec)
+            file2 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data2, col2, vec)
             
-            df1 = pd.read_csv(file1, header=None, index_col=0).values
-            df2 = pd.read_csv(file2, header=None, index_col=0).values
-            if gpu:
-                df1 = torch.Tensor(df1)
-                df2 = torch.Tensor(df2)
-            
-            for k in ks:
-                print('\t{} {} {}\r'.format(nocol, vec, k), end='')
-                
-                '''
-                #exact - query2input
+            _, df1 = load_embeddings(file1, storage=storage)
+            _, df2 = load_embeddings(file2, storage=storage)
+            path = storage_path(file1, storage)
+            sources = [store_digest(storage_path(file, storage)) for file in [file1, file2]]
+            dimensions, reduction_time = df1.shape[1], 0
+            if reduction is not None:
+                # Both collections go through the same transform, fitted once
+                # per store pair and kept next to the first store
+                method, dimensions = reduction
                 t1 = time()
-                results = find_exact_nns(df1, df2, k, gpu)
-                t2 = time()
-                recall = calc_recall(ground_results, results)
-                precision = calc_precision(ground_results, results)
-                scores2.append((nocase, nocol, vec, k, 'q2i', 'exact', recall, precision, t2-t1))
-                '''
+                transform, _ = get_reduction(f'{path}.{method}{dimensions}.npz',
+                                             method, dimensions, [df1, df2], sources)
+                df1, df2 = transform.transform(df1), transform.transform(df2)
+                reduction_time = time() - t1
+                # The transform depends on both stores, and so does any index
+                # over the reduced first collection
+                path, sources = f'{path}.{method}{dimensions}', [f'{source}.{transform.digest()}' for source in sources]
+            if approx:
+                kind = index_kind('float32' if reduction is not None else storage, gpu)
+                index, build_time, loaded = get_index(path, sources[0], kind, hnsw_params, df1)
+            if storage == 'float32' and reduction is None:
+                baseline = {}
+            
+            # Every k is a prefix of the neighbours at the largest one, sorted
+            # by distance, so each direction is searched once per sweep
+            print('\t{} {} {} {}\r'.format(nocol, vec, storage, dimensions), end='')
                                 
-                #exact - input2query
-                t1 = time()
-                results = find_exact_nns(df2, df1, k, gpu)
-                t2 = time()
-                results = set([(y,x) for x,y in results]) #reverse the input to query results to become (q_id, in_id)
-                recall = calc_recall(ground_results, results)
-                precision = calc_precision(ground_results, results)
-                scores2.append((nocase, nocol, vec, k, 'i2q', 'exact', recall, precision, t2-t1))
-                
-                '''                
-                #approx - query2input
-                t1 = time()
-                results = find_approx_nns(df1, df2, k, gpu)
-                t2 = time()
-                recall = calc_recall(ground_results, results)
-                precision = calc_precision(ground_results, results)
-                scores2.append((nocase, nocol, vec, k, 'q2i', 'approx', recall, precision, t2-t1))  
-                
+            #exact - input2query
+            t1 = time()
+            indices = find_exact_nns(df2, df1, max(ks), gpu)
+            search_time = time() - t1
+            #reverse the input to query results to become (q_id, in_id)
+            for k, results, recall, precision, eval_time in sweep(indices, ks, ground_results, reverse=True):
+                baseline.setdefault((k, 'i2q'), recall)
+                scores2.append((nocase, nocol, vec, k, 'i2q', 'exact', recall, precision, search_time + eval_time,
+                                storage, recall - baseline[(k, 'i2q')],
+                                reduction[0] if reduction else 'none', dimensions, reduction_time,
+                                0, search_time, None, len(results)))
+            
+            if approx:
                 #approx - input2query
                 t1 = time()
-                results = find_approx_nns(df2, df1, k, gpu)
-                t2 = time()
-                results = set([(y,x) for x,y in results]) #reverse the input to query results to become (q_id, in_id)
-                recall = calc_recall(ground_results, results)
-                precision = calc_precision(ground_results, results)
-                scores2.append((nocase, nocol, vec, k, 'i2q', 'approx', recall, precision, t2-t1))
-                '''
+                labels = find_approx_nns(index, kind, df2, max(ks))
+                search_time = time() - t1
+                for k, results, recall, precision, eval_time in sweep(labels, ks, ground_results, reverse=True):
+                    baseline.setdefault((k, 'i2q', 'approx'), recall)
+                    # Time is the whole blocking cost, as if the graph were built for this sweep
+                    scores2.append((nocase, nocol, vec, k, 'i2q', 'approx', recall, precision,
+                                    build_time + search_time + eval_time,
+                                    storage, recall - baseline[(k, 'i2q', 'approx')],
+                                    reduction[0] if reduction else 'none', dimensions, reduction_time,
+                                    build_time, search_time, loaded, len(results)))
                 #scores2.append((nocase, nocol, vec, k, rec_qi, rec_iq))
             #break
         #break
@@ -165,7 +117,10 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
     
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
 results = pd.DataFrame(scores2, columns=['Case', 'Columns', 'Vectorizer', 'k', 'Direction',
-                                         'Exact', 'Recall', 'Precision', 'Time'])    
+                                         'Exact', 'Recall', 'Precision', 'Time',
+                                         'Storage', 'Recall Delta', 'Reduction', 'Dimensions',
+                                         'Reduction Time', 'Build Time', 'Query Time', 'Index Loaded',
+                                         'Candidates'])    
 results.to_csv(log_file, header=True, index=True)
 results
 
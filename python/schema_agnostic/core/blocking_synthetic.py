@@ -1,96 +1,34 @@
 import os
 import pandas as pd
-import torch
-from scipy.spatial.distance import cdist
 from time import time
-import faiss
-import hnswlib
-import numpy as np
 from utils import vectorizers
 import sys
+from embedding_store import load_embeddings, storage_path, store_digest
+from reduction import get_reduction, parse_reductions
+from knn import exact_knn
+from candidates import CandidatePairs, sweep
+from ann_index import get_index, index_bytes, index_kind, ivfpq_params, rerank, search_index
 
 
-def topk(x, k):
-    out = []
-    for no, xx in enumerate(x):
-        out.append((no, xx))
-    out = sorted(out, key=lambda x: x[1])
-    return out[:k]
-
 def find_exact_nns(tensor1, tensor2, k, offset, gpu=False):
-    if gpu:
-        tensor11 = torch.Tensor(tensor1)
-        tensor22 = torch.Tensor(tensor2)
-        
-        dists = torch.cdist(tensor11, tensor22, p=2)
-        
-        topk_dists = torch.topk(dists, k+1, largest=False)
-        results = []
-        for no, res_list in enumerate(topk_dists.indices):
-            for res in res_list:
-                #results.append((no+offset, res.item()+offset))
-                nores = res.item()
-                if no+offset == nores:
-                    continue
-                # if no+offset < nores:
-                    # results.append((no+offset, nores))
-                results.append(tuple(sorted((no+offset, nores))))
-        #results = set(results)
-        return results
-    else:
-        dists = cdist(tensor1, tensor2)
-        results = []
-        for no, dist_list in enumerate(dists):
-            for res in topk(dist_list, k):
-                results.append((no, res[0]))
-        results = set(results)
-        return results
+    """Self-join of the rows of tensor1, the block of tensor2 from `offset` on."""
+    indices, _ = exact_knn(tensor1, tensor2, k+1, gpu)
+    return CandidatePairs.from_topk(indices, offset, symmetric=True)
     
-def find_approx_nns(tensor1, tensor2, k, gpu=False):
-    num_elements, dim = tensor2.shape
-
-    if gpu:
-        tensor11 = np.float32(tensor1.copy(order='C'))
-        tensor22 = np.float32(tensor2.copy(order='C'))
-
-        index = faiss.IndexHNSWFlat(dim, 16)
-        index.hnsw.efConstruction = 200
-        index.add(tensor22)  # build the index
-        index.hnsw.efSearch = 50
-        distances, labels = index.search(tensor11, k=k+1)
-
-        results = []
-        for no, label_list in enumerate(labels):
-            for res in label_list:
-                if no == res:
-                    continue
-                elif no < res:
-                    left, right = no, res
-                else:
-                    left, right = res, no
-                results.append((left, right))
-        results = set(results)
-        return results
-    else:
-        p = hnswlib.Index(space = 'l2', dim = dim)
-        p.init_index(max_elements = num_elements, ef_construction = 200, M = 16)
-        p.add_items(tensor2)
-        p.set_ef(50)
-        labels, distances = p.knn_query(tensor1, k = k)
-    
-        results = []
-        for no, label_list in enumerate(labels):
-            for res in label_list:
-                results.append((no, res))
-        results = set(results)
-        return results
-
-
-def calc_recall(true, preds):
-    return len(true & preds) / len(true)
-
-def calc_precision(true, preds):
-    return len(true & preds) / len(preds)
+def find_approx_nns(index, kind, tensor1, k, batch_size=5000, nprobe=16, rerank_factor=0):
+    """
+    Self-join of the rows of tensor1 through an HNSW or IVF-PQ index over
+    them. Returns the neighbour labels and the number of extra columns: the
+    faiss indexes are searched for one more neighbour, each row itself. With
+    a `rerank_factor`, IVF-PQ returns a shortlist that many times longer,
+    re-ordered by exact distances read from the store.
+    """
+    extra = 0 if kind == 'hnswlib' else 1
+    if kind == 'ivfpq' and rerank_factor:
+        shortlist = search_index(index, kind, tensor1, (k+extra) * rerank_factor,
+                                 batch_size=batch_size, nprobe=nprobe)
+        return rerank(tensor1, tensor1, shortlist, k+extra), extra
+    return search_index(index, kind, tensor1, k+extra, batch_size=batch_size, nprobe=nprobe), extra
 
 
 # # Start NNS Euclidean - Synthetic
@@ -100,6 +38,10 @@ emb_dir = sys.argv[2]
 log_file = sys.argv[3] + 'blocking_euclidean_synthetic.csv'
 ks = [10]
 gpu = True
+# float32 always runs first, as the baseline of the recall deltas
+storages = ['float32'] + (sys.argv[sys.argv.index('--storage')+1].split(',') if '--storage' in sys.argv else [])
+# e.g. --reduce pca:64,rp:128, each run after the full-dimensional vectors
+reductions = [None] + parse_reductions(sys.argv)
 
 scores2 = []
 
@@ -107,11 +49,23 @@ files = ['10K.csv', '50K.csv', '100K.csv', '200K.csv', '300K.csv', '1M.csv', '2M
 nocol, col, sep = 2, 'aggregated', "|"
 
 batch_size = 5000
+# Graphs are saved next to their stores and reused by later runs
+hnsw_params = {'M': 16, 'ef_construction': 200}
+# --ivfpq swaps the graphs for an IVF-PQ index trained on a sample, so only
+# the PQ codes are held in memory; the defaults follow ivfpq_params
+ivfpq = '--ivfpq' in sys.argv
+nlist = int(sys.argv[sys.argv.index('--nlist')+1]) if '--nlist' in sys.argv else None
+nprobe = int(sys.argv[sys.argv.index('--nprobe')+1]) if '--nprobe' in sys.argv else 16
+pq_m = int(sys.argv[sys.argv.index('--pq-m')+1]) if '--pq-m' in sys.argv else None
+pq_bits = int(sys.argv[sys.argv.index('--pq-bits')+1]) if '--pq-bits' in sys.argv else 8
+opq = '--opq' in sys.argv
+train_size = int(sys.argv[sys.argv.index('--train-size')+1]) if '--train-size' in sys.argv else None
+rerank_factor = int(sys.argv[sys.argv.index('--rerank')+1]) if '--rerank' in sys.argv else 0
 
 i=0
 os.makedirs(os.path.dirname(log_file), exist_ok=True)
 with open(log_file, 'w') as o:
-        o.write('Case,Columns,Vectorizer,k,Direction,Exact,Recall,Precision,Time\n')
+        o.write('Case,Columns,Vectorizer,k,Direction,Exact,Recall,Precision,Time,Storage,Recall Delta,Reduction,Dimensions,Reduction Time,Build Time,Query Time,Index Loaded,Candidates,Index,Index Bytes\n')
         for nocase, file in enumerate(files):
             
             name = file.split('.')[0]
@@ -121,22 +75,56 @@ with open(log_file, 'w') as o:
             
             ground_file = '{}{}duplicates.csv'.format(data_dir, name)
             ground_df = pd.read_csv(ground_file, sep=sep)
-            ground_results = set(ground_df.apply(lambda x: (x[0], x[1]), axis=1).values)
+            ground_results = CandidatePairs.from_ground_truth(ground_df)
             
-            for vec in vectorizers:
-                print('\t{}\r'.format(vec), end='')
-                file = '{}/{}_{}_{}.csv'.format(emb_dir, name, col, vec)
-                df = pd.read_csv(file, header=None, index_col=0).values
-                
-                for k in ks:
-                    
-                    #approx - NNS
+            for vec, storage, reduction in [(vec, storage, reduction) for vec in vectorizers
+                                            for storage in storages for reduction in reductions]:
+                print('\t{} {} {}\r'.format(vec, storage, reduction), end='')
+                file = '{}/{}_{}_{}'.format(emb_dir, name, col, vec)
+                _, df = load_embeddings(file, storage=storage)
+                path = storage_path(file, storage)
+                source = store_digest(path)
+                dimensions, reduction_time = df.shape[1], 0
+                if reduction is not None:
+                    method, dimensions = reduction
                     t1 = time()
-                    results = find_approx_nns(df, df, k, gpu)
-                    t2 = time()
-                    recall = calc_recall(ground_results, results)
-                    precision = calc_precision(ground_results, results)
+                    transform, _ = get_reduction(f'{path}.{method}{dimensions}.npz', method, dimensions,
+                                                 [df], [source])
+                    df = transform.transform(df)
+                    reduction_time = time() - t1
+                    path, source = f'{path}.{method}{dimensions}', f'{source}.{transform.digest()}'
+                if storage == 'float32' and reduction is None:
+                    baseline = {}
+                
+                if ivfpq:
+                    kind = 'ivfpq'
+                    params = ivfpq_params(len(df), df.shape[1], nlist, pq_m, pq_bits, opq, train_size)
+                else:
+                    # Reduced vectors are float32 whatever the store
+                    kind = index_kind('float32' if reduction is not None else storage, gpu)
+                    params = hnsw_params
+                index, build_time, loaded = get_index(path, source, kind, params, df, batch_size)
+                size = index_bytes(path, kind, params)
+                label = kind
+                if ivfpq:
+                    label = 'ivfpq_nlist{}_m{}x{}{}_nprobe{}_rerank{}'.format(params['nlist'], params['m'], params['nbits'],
+                                                                            '_opq' if opq else '', nprobe, rerank_factor)
+                
+                #approx - NNS, searched once at the largest k as every k is a prefix of it
+                t1 = time()
+                labels, extra = find_approx_nns(index, kind, df, max(ks), batch_size, nprobe, rerank_factor)
+                search_time = time() - t1
+                for k, results, recall, precision, eval_time in sweep(labels, ks, ground_results,
+                                                                      symmetric=extra > 0, extra=extra):
+                    baseline.setdefault(k, recall)
                     #scores2.append((nocase, nocol, vec, k, 'i2q', 'approx', recall, precision, t2-t1))  
           
-                    o.write('{},{},{},{},{},{},{},{},{},{}\n'.format(i, nocase, nocol, vec, k, 'i2q', 'approx', recall, precision, t2-t1))
+                    # Time is the whole blocking cost, as if the graph were built for this sweep
+                    o.write('{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n'.format(i, nocase, nocol, vec, k, 'i2q', 'approx', recall, precision,
+                                                                                               build_time + search_time + eval_time,
+                                                                                               storage, recall - baseline[k],
+                                                                                               reduction[0] if reduction else 'none',
+                                                                                               dimensions, reduction_time,
+                                                                                               build_time, search_time, loaded, len(results),
+                                                                                               label, size))
                     i += 1
@@ -0,0 +1,138 @@
+import numpy as np
+from time import time
+
+
+SHIFT = np.int64(32)
+MASK = np.int64(2**32 - 1)
+
+
+def pair_keys(left, right):
+    """Encodes (left, right) row ids, both in [0, 2^32), as int64 keys left * 2^32 + right."""
+    left = np.asarray(left, dtype=np.int64).ravel()
+    right = np.asarray(right, dtype=np.int64).ravel()
+    if len(left) != len(right):
+        raise ValueError(f'Got {len(left)} left and {len(right)} right ids')
+    if len(left) and (min(left.min(), right.min()) < 0 or max(left.max(), right.max()) > MASK):
+        raise ValueError('Row ids must be in [0, 2^32)')
+    return (left << SHIFT) | right
+
+
+class CandidatePairs:
+    """
+    A set of (left, right) row id pairs held as a sorted array of unique int64
+    keys, so that the union, intersection and size of candidate sets, and the
+    recall and precision computed from them, are array operations.
+    """
+
+    def __init__(self, keys, unique=False):
+        keys = np.asarray(keys, dtype=np.int64)
+        self.keys = keys if unique else np.unique(keys)
+
+    @classmethod
+    def from_arrays(cls, left, right):
+        return cls(pair_keys(left, right))
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """From an iterable of (left, right) tuples."""
+        pairs = np.asarray(list(pairs), dtype=np.int64).reshape(-1, 2)
+        return cls.from_arrays(pairs[:, 0], pairs[:, 1])
+
+    @classmethod
+    def from_topk(cls, indices, offset=0, symmetric=False):
+        """
+        From a (queries x k) matrix of neighbour row ids, the pairs (query row
+        + offset, neighbour). Negative ids, as faiss returns for missing
+        neighbours, are dropped. `symmetric` is for self-joins: a row is not
+        paired with itself and every pair is ordered as (smaller, larger).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        queries = np.repeat(np.arange(offset, offset+len(indices), dtype=np.int64), indices.shape[1])
+        neighbours = indices.ravel()
+        keep = neighbours >= 0
+        if symmetric:
+            keep &= neighbours != queries
+        queries, neighbours = queries[keep], neighbours[keep]
+        if symmetric:
+            queries, neighbours = np.minimum(queries, neighbours), np.maximum(queries, neighbours)
+        return cls.from_arrays(queries, neighbours)
+
+    @classmethod
+    def from_ground_truth(cls, df):
+        """From the pairs in the first two columns of a ground truth DataFrame."""
+        return cls.from_arrays(df.iloc[:, 0].values, df.iloc[:, 1].values)
+
+    @classmethod
+    def union_all(cls, candidates):
+        candidates = list(candidates)
+        if not candidates:
+            return cls(np.empty(0, dtype=np.int64), unique=True)
+        return cls(np.concatenate([c.keys for c in candidates]))
+
+    @property
+    def left(self):
+        return self.keys >> SHIFT
+
+    @property
+    def right(self):
+        return self.keys & MASK
+
+    def reversed(self):
+        """Returns the (right, left) pairs."""
+        return CandidatePairs.from_arrays(self.right, self.left)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __and__(self, other):
+        return CandidatePairs(np.intersect1d(self.keys, other.keys, assume_unique=True), unique=True)
+
+    def __or__(self, other):
+        return CandidatePairs(np.union1d(self.keys, other.keys), unique=True)
+
+    def __sub__(self, other):
+        return CandidatePairs(np.setdiff1d(self.keys, other.keys, assume_unique=True), unique=True)
+
+    def __contains__(self, pair):
+        key = pair_keys([pair[0]], [pair[1]])[0]
+        i = np.searchsorted(self.keys, key)
+        return i < len(self.keys) and self.keys[i] == key
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def tolist(self):
+        return list(zip(self.left.tolist(), self.right.tolist()))
+
+    def __repr__(self):
+        return f'CandidatePairs({len(self)} pairs)'
+
+
+def evaluate(true, preds):
+    """Returns the (recall, precision, f1) of the candidates `preds` against the pairs `true`."""
+    true_positives = len(true & preds)
+    if true_positives == 0:
+        return 0, 0, 0
+    recall = true_positives / len(true)
+    precision = true_positives / len(preds)
+    return recall, precision, 2 * (precision*recall) / (precision + recall)
+
+
+def sweep(indices, ks, true=None, offset=0, symmetric=False, reverse=False, extra=0):
+    """
+    Yields (k, candidates, recall, precision, time) for every k in `ks` from
+    one search at max(ks): as the neighbours in `indices` are sorted by
+    distance, those of k are its first k (+ `extra`, e.g. a self-join's own
+    row) columns. `reverse` turns (query, neighbour) pairs into (neighbour,
+    query) ones. Recall and precision are None without the `true` pairs, and
+    time is that of building and scoring the candidates of k.
+    """
+    for k in ks:
+        start = time()
+        candidates = CandidatePairs.from_topk(indices[:, :k+extra], offset, symmetric)
+        if reverse:
+            candidates = candidates.reversed()
+        recall, precision = None, None
+        if true is not None:
+            recall, precision, _ = evaluate(true, candidates)
+        yield k, candidates, recall, precision, time() - start
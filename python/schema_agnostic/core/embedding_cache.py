@@ -0,0 +1,88 @@
+import os
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def dedup(text):
+    """
+    Returns the unique texts in order of first appearance and, for every
+    input text, the position of its unique copy.
+    """
+    inverse, unique = pd.factorize(pd.Series(text, dtype=object), sort=False)
+    return list(unique), inverse
+
+
+def text_hashes(text):
+    """Returns a 16-byte digest of every text as a fixed-width bytes array."""
+    return np.array([hashlib.blake2b(t.encode('utf-8'), digest_size=16).digest()
+                     for t in text], dtype='S16')
+
+
+def chunk_key(text, index, width=1):
+    """
+    Returns a hex digest of a chunk of texts together with their ids. A chunk
+    of `width` columns holds the texts of every column in turn, all hashed.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for column in range(width):
+        for i, t in zip(index, text[column*len(index):(column+1)*len(index)]):
+            h.update(f'{i}\x1f{t}\x1e'.encode('utf-8'))
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings, keyed by (vectorizer, model
+    revision, max_length, text hash). Every add writes one shard of
+    <n>.vectors.npy and <n>.keys.npy; the keys file is written last, so a
+    shard without one is ignored. Vectors are memory-mapped on load.
+    """
+
+    def __init__(self, cache_dir, vectorizer, revision, max_length=None):
+        name = f'{vectorizer}_{revision}_{max_length}'
+        self.dir = os.path.join(cache_dir, re.sub(r'[^\w.-]', '_', name))
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.shards = []
+        self.index = {}
+        for file in sorted(os.listdir(self.dir)):
+            if file.endswith('.keys.npy'):
+                self.load_shard(file[:-len('.keys.npy')])
+
+    def shard_files(self, name):
+        return (os.path.join(self.dir, name + '.keys.npy'),
+                os.path.join(self.dir, name + '.vectors.npy'))
+
+    def load_shard(self, name):
+        keys_file, vectors_file = self.shard_files(name)
+        keys = np.load(keys_file)
+        vectors = np.load(vectors_file, mmap_mode='r')
+        shard = len(self.shards)
+        self.shards.append(vectors)
+        for row, key in enumerate(keys):
+            self.index[key] = (shard, row)
+
+    def lookup(self, hashes):
+        """
+        Returns a boolean mask of the hashes found in the cache and the
+        vectors of the found ones, in order.
+        """
+        found = np.array([h in self.index for h in hashes], dtype=bool)
+        vectors = [self.shards[shard][row]
+                   for shard, row in (self.index[h] for h in hashes[found])]
+        return found, np.array(vectors)
+
+    def add(self, hashes, vectors):
+        if len(hashes) == 0:
+            return
+        name = '{:06d}'.format(len(self.shards))
+        while os.path.exists(self.shard_files(name)[0]):
+            name = '{:06d}'.format(int(name) + 1)
+        keys_file, vectors_file = self.shard_files(name)
+
+        np.save(vectors_file, np.asarray(vectors, dtype=np.float32))
+        np.save(keys_file + '.tmp.npy', hashes)
+        os.replace(keys_file + '.tmp.npy', keys_file)
+        self.load_shard(name)
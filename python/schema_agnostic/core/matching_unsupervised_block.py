@@ -5,6 +5,10 @@ from time import time
 from utils import cases, cosine_similarity
 import sys
 import os
+import numpy as np
+from embedding_store import load_embeddings
+from candidates import CandidatePairs, evaluate
+from quantization import squared_l2
 
 vectorizers = ['st5']
 
@@ -17,9 +21,13 @@ if cosine:
 else:
    sim = 'euclidean'
 
+# float16 and int8 read the copies written by vectorization with --storage
+storage = sys.argv[sys.argv.index('--storage')+1] if '--storage' in sys.argv else 'float32'
+suffix = '' if storage == 'float32' else '_' + storage
+
 data_dir = sys.argv[1]
 emb_dir = sys.argv[2]
-log_file = sys.argv[3] + f'matching_unsupervised_{sim}_block.csv'
+log_file = sys.argv[3] + f'matching_unsupervised_{sim}_block{suffix}.csv'
 
 scores2 = []
 
@@ -35,7 +43,7 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
     ground_file = '{}/{}/{}.csv'.format(data_dir, dir, ground_file)
     ground_df = pd.read_csv(ground_file, sep=sep)
     # ground_results = set(ground_df.apply(lambda x: (f'r_{x[0]}', f's_{x[1]}'), axis=1).values)
-    ground_results = set(ground_df.apply(lambda x: (x[0], x[1]), axis=1).values)
+    ground_results = CandidatePairs.from_ground_truth(ground_df)
     
     for nocol, (col1, col2) in enumerate(cols):
         if nocol!=2:
@@ -44,23 +52,28 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
             print('\t{} {}\r'.format(nocol, vec), end='')
             torch.cuda.empty_cache()
             #print()
-            file1 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data1, col1, vec)
-            file2 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data2, col2, vec)
+            file1 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data1, col1, vec)
+            file2 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data2, col2, vec)
             
-            df1 = pd.read_csv(file1, header=None, index_col=0).values
-            df2 = pd.read_csv(file2, header=None, index_col=0).values
+            _, df1 = load_embeddings(file1, storage=storage)
+            _, df2 = load_embeddings(file2, storage=storage)
                 
             #cdists
             dist_time = time()
             
-            df1 = torch.Tensor(df1).cuda()
-            df2 = torch.Tensor(df2).cuda()
+            if storage == 'float32' or cosine:
+                df1 = torch.Tensor(np.asarray(df1, dtype=np.float32)).cuda()
+                df2 = torch.Tensor(np.asarray(df2, dtype=np.float32)).cuda()
             
             #df1 = torch.Tensor(df1)
             #df2 = torch.Tensor(df2)
             
             if cosine:
                     dists = cosine_similarity(df1, df2)
+            elif storage != 'float32':
+                    # Rows are dequantized inside the distance computation
+                    dists = torch.from_numpy(np.sqrt(squared_l2(df1, df2))).cuda()
+                    dists.add_(1.0).pow_(-1)
             else:
                     dists = torch.cdist(df1, df2, p=2)
                     # dists = 1 / (1+dists)
@@ -96,16 +109,10 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
             for noind, (i, j, dist) in enumerate(edges):
                 
                 while dist < delta:
-                    results2 = set(results)
+                    results2 = CandidatePairs.from_pairs(results)
                     matching_time2 = time() - matching_time
         
-                    true_positives = len(ground_results & results2)
-                    if true_positives > 0:
-                        recall =  true_positives / len(ground_results)
-                        precision =  true_positives / len(results2)
-                        f1 = 2 * (precision*recall) / (precision + recall)
-                    else:
-                        recall, precision, f1 = 0, 0, 0
+                    recall, precision, f1 = evaluate(ground_results, results2)
                    
                     scores2.append((nocase, nocol, vec, recall, precision, f1, dist_time, matching_time2, len(results2), delta)) 
                     delta -= 0.05
@@ -126,19 +133,13 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
                     break
                 
             
-            results = set(results)
+            results = CandidatePairs.from_pairs(results)
             matching_time = time() - matching_time
 
 
             #recall
             recall_time = time()
-            true_positives = len(ground_results & results)
-            if true_positives > 0:
-                recall =  true_positives / len(ground_results)
-                precision =  true_positives / len(results)
-                f1 = 2 * (precision*recall) / (precision + recall)
-            else:
-                recall, precision, f1 = 0, 0, 0
+            recall, precision, f1 = evaluate(ground_results, results)
             recall_time = time() - recall_time  
             
             del dists
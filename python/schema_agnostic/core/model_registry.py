@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from time import time
+import gc
+import os
+import sys
+import numpy as np
+
+
+def loaded_torch():
+    """Returns torch if it has been imported, e.g. by a vectorizer, else None."""
+    return sys.modules.get('torch')
+
+
+def empty_cuda_cache():
+    torch = loaded_torch()
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def model_size(model):
+    """
+    Estimates the resident size in bytes of a loaded vectorizer: parameters
+    and buffers of torch modules, vector tables of gensim models. Tuples such
+    as (tokenizer, model) are summed. Memory-mapped tables live in the shared
+    page cache and are not counted.
+    """
+    if isinstance(model, (tuple, list)):
+        return sum(model_size(m) for m in model)
+    torch = loaded_torch()
+    if torch is not None and isinstance(model, torch.nn.Module):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if hasattr(model, 'wv'):
+        model = model.wv
+    size = 0
+    for attr in ['vectors', 'vectors_vocab', 'vectors_ngrams']:
+        vectors = getattr(model, attr, None)
+        if vectors is not None and hasattr(vectors, 'nbytes') and \
+                not isinstance(vectors, np.memmap):
+            size += vectors.nbytes
+    return size
+
+
+def registry_settings(max_models=None, memory_budget=None, memory_fraction=0.5):
+    """
+    Returns the (max_models, memory_budget in bytes) of a registry: the
+    given values, else those of the EMB4ER_MAX_MODELS and
+    EMB4ER_MODEL_MEMORY (GB) environment variables, else 2 models within
+    `memory_fraction` of the physical memory of the machine.
+    """
+    if max_models is None:
+        max_models = int(os.environ.get('EMB4ER_MAX_MODELS', 2))
+    if memory_budget is None and 'EMB4ER_MODEL_MEMORY' in os.environ:
+        memory_budget = float(os.environ['EMB4ER_MODEL_MEMORY']) * 1024**3
+    if memory_budget is None:
+        import psutil
+        memory_budget = psutil.virtual_memory().total * memory_fraction
+    return max_models, int(memory_budget)
+
+
+class ModelRegistry:
+    """
+    Keeps loaded vectorizers warm across create_embeddings calls. At most
+    `max_models` models stay resident and, when `memory_budget` (bytes) is
+    set, the least recently used ones are evicted until the rest fit in it.
+    The most recently requested model is never evicted.
+    """
+
+    def __init__(self, max_models=2, memory_budget=None):
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.models = OrderedDict()
+        self.stats = {}
+
+    def get(self, key, loader):
+        """
+        Returns (model, init_time, saved_time). On a miss the model is built
+        with `loader()` and init_time is its load time; on a hit init_time is
+        0 and saved_time is the load time that was avoided.
+        """
+        stats = self.stats.setdefault(key, {'loads': 0, 'hits': 0,
+                                            'init_time': 0.0, 'saved_time': 0.0})
+        if key in self.models:
+            self.models.move_to_end(key)
+            model, size, init_time = self.models[key]
+            stats['hits'] += 1
+            stats['saved_time'] += init_time
+            return model, 0.0, init_time
+
+        init_time = time()
+        model = loader()
+        init_time = time() - init_time
+
+        self.models[key] = (model, model_size(model), init_time)
+        stats['loads'] += 1
+        stats['init_time'] += init_time
+        self.evict()
+        return model, init_time, 0.0
+
+    def resident_size(self):
+        return sum(size for _, size, _ in self.models.values())
+
+    def evict(self):
+        evicted = False
+        while len(self.models) > 1:
+            over_count = len(self.models) > self.max_models
+            over_budget = self.memory_budget is not None and \
+                self.resident_size() > self.memory_budget
+            if not (over_count or over_budget):
+                break
+            self.models.popitem(last=False)
+            evicted = True
+        if evicted:
+            gc.collect()
+            empty_cuda_cache()
+
+    def configure(self, max_models=None, memory_budget=None):
+        """Changes the limits that are given, evicting models beyond them."""
+        if max_models is not None:
+            self.max_models = max_models
+        if memory_budget is not None:
+            self.memory_budget = memory_budget
+        self.evict()
+
+    def clear(self):
+        self.models.clear()
+        gc.collect()
+        empty_cuda_cache()
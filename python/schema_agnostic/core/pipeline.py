@@ -0,0 +1,147 @@
+import queue
+import threading
+from contextlib import contextmanager
+from time import time
+
+
+class StageClock:
+    """Splits the wall time of a pipeline stage into busy and idle time."""
+
+    def __init__(self):
+        self.busy_time = 0.0
+        self.idle_time = 0.0
+
+    @contextmanager
+    def busy(self):
+        t1 = time()
+        try:
+            yield
+        finally:
+            self.busy_time += time() - t1
+
+    @contextmanager
+    def idle(self):
+        t1 = time()
+        try:
+            yield
+        finally:
+            self.idle_time += time() - t1
+
+    def stats(self):
+        total = self.busy_time + self.idle_time
+        return {'busy_time': self.busy_time, 'idle_time': self.idle_time,
+                'utilization': self.busy_time / total if total > 0 else None}
+
+
+def stage_clocks():
+    return {'tokenize': StageClock(), 'model': StageClock(), 'write': StageClock()}
+
+
+_done = object()
+
+
+class Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class Producer:
+    """
+    Iterates `items` in a background thread and hands them, in order, to
+    whoever iterates the producer, holding at most `maxsize` of them.
+    Producing an item is busy time of `clock` and waiting for room in the
+    queue is idle time; waiting for an item is idle time of
+    `consumer_clock`. An exception in the thread is re-raised in the
+    consumer.
+    """
+
+    def __init__(self, items, clock, consumer_clock=None, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.clock = clock
+        self.consumer_clock = consumer_clock or StageClock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(items,), daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self, items):
+        try:
+            items = iter(items)
+            while not self.stopped.is_set():
+                with self.clock.busy():
+                    item = next(items, _done)
+                with self.clock.idle():
+                    self.put(item)
+                if item is _done:
+                    break
+        except BaseException as e:
+            self.put(Failure(e))
+
+    def __iter__(self):
+        while True:
+            with self.consumer_clock.idle():
+                item = self.queue.get()
+            if item is _done:
+                return
+            if isinstance(item, Failure):
+                raise item.error
+            yield item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Consumer:
+    """
+    Applies `function` to every item put to it in a background thread,
+    holding at most `maxsize` pending items. Applying it is busy time of
+    `clock` and waiting for an item is idle time; a put blocked on a full
+    queue is idle time of `producer_clock`. close() waits for the pending
+    items and re-raises an exception of the thread.
+    """
+
+    def __init__(self, function, clock, producer_clock=None, maxsize=2):
+        self.function = function
+        self.queue = queue.Queue(maxsize)
+        self.clock = clock
+        self.producer_clock = producer_clock or StageClock()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.clock.idle():
+                item = self.queue.get()
+            if item is _done:
+                break
+            # After a failure the remaining items are only drained
+            if self.error is not None:
+                continue
+            try:
+                with self.clock.busy():
+                    self.function(item)
+            except BaseException as e:
+                self.error = e
+
+    def put(self, item):
+        if self.error is not None:
+            self.close()
+        with self.producer_clock.idle():
+            self.queue.put(item)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_done)
+            self.thread.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
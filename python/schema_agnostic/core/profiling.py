@@ -0,0 +1,68 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from time import time
+from autotune import RssSampler
+
+
+def profile_path(log_file):
+    """Returns the JSONL file written next to `log_file`."""
+    return os.path.splitext(log_file)[0] + '.profile.jsonl'
+
+
+class BatchProfiler:
+    """
+    Appends one JSON line per encoded batch, per encoded chunk and per
+    written chunk of a create_embeddings run to `path`: the timings of each
+    stage, real and padded token counts, and the peak RSS since the
+    previous line, sampled by a background thread. Every line carries the
+    fields of `context`.
+
+    With `trace_batch`, that batch of a BERT-family model is also profiled
+    with torch.profiler and a Chrome trace is written into `trace_dir`.
+    """
+
+    def __init__(self, path, context, trace_batch=None, trace_dir=None, name='trace'):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.f = open(path, 'a')
+        self.context = context
+        self.trace_batch = trace_batch
+        self.trace_dir = trace_dir
+        self.name = name
+        self.batches = 0
+        self.lock = threading.Lock()
+        self.sampler = RssSampler()
+        self.sampler.__enter__()
+
+    def next_batch(self):
+        """Returns the number of the next batch and whether to trace it."""
+        with self.lock:
+            no = self.batches
+            self.batches += 1
+        return no, no == self.trace_batch
+
+    def record(self, kind, **fields):
+        with self.lock:
+            self.sampler.sample()
+            peak, self.sampler.peak = self.sampler.peak, 0
+            record = dict(self.context, kind=kind, timestamp=time(), peak_rss=peak)
+            record.update(fields)
+            self.f.write(json.dumps(record) + '\n')
+
+    @contextmanager
+    def trace(self, no):
+        import torch
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+            yield
+        os.makedirs(self.trace_dir, exist_ok=True)
+        path = os.path.join(self.trace_dir, f'{self.name}_batch{no}.json')
+        prof.export_chrome_trace(path)
+        self.record('trace', batch=no, trace=path)
+
+    def close(self):
+        self.sampler.__exit__(None, None, None)
+        self.f.close()
@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+import numpy as np
+from quantization import float_rows
+
+
+METHODS = ['pca', 'rp']
+
+
+def sample_vectors(collections, size, seed=0):
+    """Returns up to `size` rows drawn evenly from `collections`, as float32."""
+    total = sum(len(vectors) for vectors in collections)
+    rng = np.random.default_rng(seed)
+    samples = []
+    for vectors in collections:
+        share = len(vectors) if total <= size else int(round(size * len(vectors) / total))
+        rows = np.sort(rng.choice(len(vectors), min(share, len(vectors)), replace=False))
+        samples.append(np.asarray(vectors[rows], dtype=np.float32))
+    return np.concatenate(samples)
+
+
+class Reduction:
+    """
+    A linear map of vectors to `dimensions` dimensions, x -> (x - mean) W^T,
+    shared by both collections of a blocking case: PCA fitted on a sample,
+    or a Gaussian random projection.
+    """
+
+    def __init__(self, method, components, mean, info=None):
+        self.method = method
+        self.components = np.asarray(components, dtype=np.float32)
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.info = info or {}
+
+    @property
+    def dimensions(self):
+        return self.components.shape[0]
+
+    def digest(self):
+        """
+        Returns a digest of the settings the reduction was fitted with, which
+        include the digests of every store it was fitted on.
+        """
+        settings = json.dumps(self.info.get('settings'), sort_keys=True).encode('utf-8')
+        return hashlib.blake2b(settings, digest_size=16).hexdigest()
+
+    def transform(self, vectors, chunk_size=100000):
+        """Maps float32, float16 or quantized `vectors` chunk by chunk."""
+        reduced = np.empty((len(vectors), self.dimensions), dtype=np.float32)
+        for i in range(0, len(vectors), chunk_size):
+            chunk = float_rows(vectors, i, i+chunk_size) - self.mean
+            reduced[i:i+chunk_size] = chunk @ self.components.T
+        return reduced
+
+    def save(self, path):
+        np.savez(path + '.tmp.npz', components=self.components, mean=self.mean,
+                 method=self.method, info=json.dumps(self.info))
+        os.replace(path + '.tmp.npz', path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data['method']), data['components'], data['mean'],
+                       json.loads(str(data['info'])))
+
+
+def fit_pca(sample, dimensions):
+    mean = sample.mean(axis=0)
+    _, singular_values, vt = np.linalg.svd(sample - mean, full_matrices=False)
+    variance = singular_values ** 2
+    explained = float(variance[:dimensions].sum() / variance.sum()) if variance.sum() > 0 else None
+    return Reduction('pca', vt[:dimensions], mean, {'explained_variance': explained})
+
+
+def fit_random_projection(source_dimensions, dimensions, seed=0):
+    # N(0, 1/dimensions) entries preserve distances in expectation
+    rng = np.random.default_rng(seed)
+    components = rng.normal(0, 1 / np.sqrt(dimensions), (dimensions, source_dimensions))
+    return Reduction('rp', components, np.zeros(source_dimensions))
+
+
+def get_reduction(path, method, dimensions, collections, sources, sample=20000, seed=0):
+    """
+    Returns the Reduction saved at `path` if it was fitted with the same
+    settings on the same stores, identified by the digests in `sources`;
+    otherwise fits it on a sample of `collections` and saves it. Also
+    returns whether it was loaded.
+    """
+    settings = {'method': method, 'dimensions': dimensions, 'sources': sources,
+                'sample': sample, 'seed': seed}
+    if os.path.exists(path):
+        reduction = Reduction.load(path)
+        if reduction.info.get('settings') == settings:
+            return reduction, True
+
+    source_dimensions = collections[0].shape[1]
+    if dimensions >= source_dimensions:
+        raise ValueError(f'Cannot reduce {source_dimensions} dimensions to {dimensions}')
+    if method == 'pca':
+        reduction = fit_pca(sample_vectors(collections, sample, seed), dimensions)
+    elif method == 'rp':
+        reduction = fit_random_projection(source_dimensions, dimensions, seed)
+    else:
+        raise ValueError(f'Unknown reduction: {method}')
+    reduction.info['settings'] = settings
+    reduction.save(path)
+    return reduction, False
+
+
+def parse_reductions(argv):
+    """Returns the (method, dimensions) pairs of `--reduce pca:64,rp:128`."""
+    if '--reduce' not in argv:
+        return []
+    reductions = []
+    for spec in argv[argv.index('--reduce')+1].split(','):
+        method, dimensions = spec.split(':')
+        if method not in METHODS:
+            raise ValueError(f'Unknown reduction: {method}')
+        reductions.append((method, int(dimensions)))
+    return reductions
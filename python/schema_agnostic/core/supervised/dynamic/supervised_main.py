@@ -62,7 +62,8 @@ if __name__ == "__main__":
                                      tokenizer,
                                      args.max_seq_length,
                                      args.train_batch_size,
-                                     DataType.TRAINING, args.model_type)
+                                     DataType.TRAINING, args.model_type,
+                                     cache_dir=args.tokenization_cache_dir)
     logging.info("loaded {} training examples".format(len(train_examples)))
 
     num_train_steps = len(training_data_loader) * args.num_epochs
@@ -81,7 +82,8 @@ if __name__ == "__main__":
                                        tokenizer,
                                        args.max_seq_length,
                                        args.eval_batch_size,
-                                       DataType.EVALUATION, args.model_type)
+                                       DataType.EVALUATION, args.model_type,
+                                       cache_dir=args.tokenization_cache_dir)
 
     evaluation = Evaluation(evaluation_data_loader, exp_name, args.model_output_dir, len(label_list), args.model_type)
     logging.info("loaded and initialized evaluation examples {}".format(len(eval_examples)))
@@ -111,7 +113,8 @@ if __name__ == "__main__":
                                  tokenizer,
                                  args.max_seq_length,
                                  args.eval_batch_size,
-                                 DataType.TEST, args.model_type)
+                                 DataType.TEST, args.model_type,
+                                 cache_dir=args.tokenization_cache_dir)
 
     include_token_type_ids = False
     if args.model_type == 'bert':
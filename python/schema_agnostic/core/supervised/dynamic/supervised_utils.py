@@ -14,6 +14,7 @@ from pytorch_transformers import AdamW, WarmupLinearSchedule
 from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification, \
     AlbertConfig, AlbertForSequenceClassification, AlbertTokenizer, \
     T5Config, T5Tokenizer, T5ForConditionalGeneration
+from tokenization_cache import TokenizationCache, corpus_key
 
 
 
@@ -62,33 +63,52 @@ class DataType(Enum):
     TEST = "Test"
 
 
-def load_data(examples, label_list, tokenizer, max_seq_length, batch_size, data_type: DataType, model_type):
-    logging.info("***** Convert Data to Features (Word-Piece Tokenizing) [{}] *****".format(data_type))
-    
-    features = convert_examples_to_features(examples,
-                                            label_list,
-                                            max_seq_length,
-                                            tokenizer,
-                                            output_mode="classification",
-                                            cls_token_at_end=bool(model_type in ['xlnet']),
-                                            # xlnet has a cls token at the end
-                                            cls_token=tokenizer.cls_token,
-                                            cls_token_segment_id=2 if model_type in ['xlnet'] else 0,
-                                            sep_token=tokenizer.sep_token,
-                                            sep_token_extra=bool(model_type in ['roberta']),
-                                            # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
-                                            pad_on_left=bool(model_type in ['xlnet']),  # pad on the left for xlnet
-                                            pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
-                                            pad_token_segment_id=4 if model_type in ['xlnet'] else 0,)
+def load_data(examples, label_list, tokenizer, max_seq_length, batch_size, data_type: DataType, model_type,
+              cache_dir=None):
+    layout = dict(cls_token_at_end=bool(model_type in ['xlnet']),
+                  # xlnet has a cls token at the end
+                  cls_token=tokenizer.cls_token,
+                  cls_token_segment_id=2 if model_type in ['xlnet'] else 0,
+                  sep_token=tokenizer.sep_token,
+                  sep_token_extra=bool(model_type in ['roberta']),
+                  # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
+                  pad_on_left=bool(model_type in ['xlnet']),  # pad on the left for xlnet
+                  pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
+                  pad_token_segment_id=4 if model_type in ['xlnet'] else 0,)
+
+    def convert():
+        logging.info("***** Convert Data to Features (Word-Piece Tokenizing) [{}] *****".format(data_type))
+        features = convert_examples_to_features(examples,
+                                                label_list,
+                                                max_seq_length,
+                                                tokenizer,
+                                                output_mode="classification",
+                                                **layout)
+        return {'input_ids': np.array([f.input_ids for f in features], dtype=np.int32),
+                'input_mask': np.array([f.input_mask for f in features], dtype=np.int8),
+                'segment_ids': np.array([f.segment_ids for f in features], dtype=np.int8),
+                'label_ids': np.array([f.label_id for f in features], dtype=np.int32)}
+
+    # Features only depend on the tokenizer, the layout and the examples, so
+    # they are shared by every run and model with an identical tokenizer
+    if cache_dir is not None:
+        cache = TokenizationCache(cache_dir, tokenizer, max_seq_length)
+        settings = json.dumps({'layout': layout, 'labels': list(label_list)}, sort_keys=True)
+        key = '{}_{}'.format(corpus_key([settings]),
+                             corpus_key([e.text_a for e in examples], [e.text_b for e in examples],
+                                        [e.label for e in examples]))
+        features = cache.corpus(key, convert)
+    else:
+        features = convert()
 
     logging.info("***** Build PyTorch DataLoader with extracted features [{}] *****".format(data_type))
     logging.info("  Num examples = %d", len(examples))
     logging.info("  Batch size = %d", batch_size)
     logging.info("  Max Sequence Length = %d", max_seq_length)
-    all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-    all_input_mask = torch.tensor([f.input_mask for f in features], dtype=torch.long)
-    all_segment_ids = torch.tensor([f.segment_ids for f in features], dtype=torch.long)
-    all_label_ids = torch.tensor([f.label_id for f in features], dtype=torch.long)
+    all_input_ids = torch.from_numpy(features['input_ids']).long()
+    all_input_mask = torch.from_numpy(features['input_mask']).long()
+    all_segment_ids = torch.from_numpy(features['segment_ids']).long()
+    all_label_ids = torch.from_numpy(features['label_ids']).long()
     data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
 
     if data_type == DataType.TRAINING:
@@ -569,11 +589,14 @@ def read_arguments_train():
     parser.add_argument('--weight_decay', default=0.0, type=float)
 
     parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--tokenization_cache_dir', default=None, type=str)
 
     args = parser.parse_args()
 
     args.data_path = os.path.join(args.data_dir, args.data_name)
     args.model_output_dir = args.exp_dir
+    if args.tokenization_cache_dir is None:
+        args.tokenization_cache_dir = os.path.join(args.exp_dir, 'tokenization_cache')
 
     logging.info("*** parsed configuration from command line and combine with constants ***")
 
@@ -0,0 +1,207 @@
+import os
+import json
+import uuid
+import hashlib
+from itertools import chain
+from time import time
+import numpy as np
+
+
+def tokenizer_fingerprint(tokenizer):
+    """
+    Returns a digest of what determines the output of `tokenizer`: its
+    vocabulary, merges, normalization and special tokens, but not its class
+    or name, so that e.g. the bert and distilbert *-base-uncased tokenizers
+    share a fingerprint.
+    """
+    if hasattr(tokenizer, 'backend_tokenizer'):
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        # Set by the last call, not part of the tokenizer
+        state.pop('truncation', None)
+        state.pop('padding', None)
+    else:
+        vocab = getattr(tokenizer, 'vocab', None) or getattr(tokenizer, 'encoder', None)
+        if vocab is None and hasattr(tokenizer, 'get_vocab'):
+            vocab = tokenizer.get_vocab()
+        ranks = getattr(tokenizer, 'bpe_ranks', {})
+        basic_tokenizer = getattr(tokenizer, 'basic_tokenizer', None)
+        state = {'vocab': sorted((vocab or {}).items(), key=lambda item: item[1]),
+                 'merges': [' '.join(pair) for pair in sorted(ranks, key=ranks.get)],
+                 'lower_case': [getattr(tokenizer, 'do_lower_case', None),
+                                getattr(basic_tokenizer, 'do_lower_case', None)],
+                 'special_tokens': tokenizer.all_special_tokens}
+        if hasattr(tokenizer, 'sp_model'):
+            proto = tokenizer.sp_model.serialized_model_proto()
+            state['sp_model'] = hashlib.blake2b(proto, digest_size=16).hexdigest()
+    state = json.dumps(state, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(state, digest_size=16).hexdigest()
+
+
+def corpus_key(*columns):
+    """Returns a hex digest of aligned columns of values, e.g. text pairs and labels."""
+    h = hashlib.blake2b(digest_size=16)
+    for row in zip(*columns):
+        h.update(('\x1f'.join(str(value) for value in row) + '\x1e').encode('utf-8'))
+    return h.hexdigest()
+
+
+def text_hashes(text):
+    return np.array([hashlib.blake2b(t.encode('utf-8'), digest_size=16).digest()
+                     for t in text], dtype='S16')
+
+
+class TokenizationCache:
+    """
+    Persistent cache of tokenizer outputs, shared by every model and run
+    whose tokenizer has the same fingerprint and max_length. Entries live in
+    <cache_dir>/<fingerprint>_<max_length>/; input ids are stored as int32
+    and attention masks and segment ids as int8.
+
+    Single texts are cached by tokenize() as shards of flat sequences plus
+    offsets, whose keys file is written last. New entries are held in memory
+    until `shard_size` of them are pending, or until flush(), and then
+    written as one shard, so a run adds few, large files. Whole padded
+    corpora, such as the pairs of the supervised matchers, are cached as
+    one entry by corpus().
+
+    Tokenizers sharing a fingerprint may still return different fields, e.g.
+    bert adds token_type_ids and distilbert does not: tokenize() returns only
+    the `fields` it is given, by default the `model_input_names` of the
+    tokenizer the cache was built with, and treats entries cached without
+    one of them as missing.
+    """
+
+    def __init__(self, cache_dir, tokenizer, max_length, shard_size=100000):
+        name = f'{tokenizer_fingerprint(tokenizer)}_{max_length}'
+        self.dir = os.path.join(cache_dir, name)
+        self.fields = list(getattr(tokenizer, 'model_input_names', ['input_ids', 'attention_mask']))
+        self.shard_size = shard_size
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.shards = []
+        self.index = {}
+        # (shard number, keys) of the in-memory shards not written yet
+        self.pending = []
+        for file in sorted(os.listdir(self.dir)):
+            if file.endswith('.keys.npy'):
+                self.load_shard(file[:-len('.keys.npy')])
+
+    def shard_file(self, name, field):
+        return os.path.join(self.dir, f'{name}.{field}.npy')
+
+    def load_shard(self, name):
+        keys = np.load(self.shard_file(name, 'keys'))
+        with open(os.path.join(self.dir, name + '.json')) as f:
+            fields = json.loads(f.read())
+        shard = {field: np.load(self.shard_file(name, field), mmap_mode='r')
+                 for field in fields + ['offsets']}
+        self.index_shard(shard, keys)
+
+    def index_shard(self, shard, keys):
+        no = len(self.shards)
+        self.shards.append(shard)
+        for row, key in enumerate(keys):
+            self.index[key] = (no, row)
+        return no
+
+    def has(self, key, fields=None):
+        """Returns True if `key` is cached with every one of `fields`."""
+        if key not in self.index:
+            return False
+        shard = self.shards[self.index[key][0]]
+        return all(field in shard for field in (fields or self.fields))
+
+    def get(self, key):
+        shard, row = self.index[key]
+        shard = self.shards[shard]
+        start, end = shard['offsets'][row], shard['offsets'][row+1]
+        return {field: values[start:end].tolist() for field, values in shard.items()
+                if field != 'offsets'}
+
+    def add(self, hashes, encoded):
+        """Adds the sequences of `encoded` under `hashes`, written on the next flush."""
+        if len(hashes) == 0:
+            return
+        lengths = [len(sequence) for sequence in encoded['input_ids']]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        shard = {'offsets': offsets}
+        for field in encoded:
+            dtype = np.int32 if field == 'input_ids' else np.int8
+            shard[field] = np.fromiter(chain.from_iterable(encoded[field]), dtype=dtype,
+                                       count=int(offsets[-1]))
+        self.pending.append((self.index_shard(shard, hashes), hashes))
+        if sum(len(keys) for _, keys in self.pending) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the pending entries as one shard per set of fields, which replaces them."""
+        groups = {}
+        for no, keys in self.pending:
+            groups.setdefault(tuple(sorted(self.shards[no])), []).append((no, keys))
+        for group in groups.values():
+            self.write_shard([self.shards[no] for no, _ in group],
+                             np.concatenate([keys for _, keys in group]))
+            for no, _ in group:
+                self.shards[no] = {}
+        self.pending = []
+
+    def write_shard(self, shards, keys):
+        # Shards are named uniquely, as workers may add to the same cache
+        name = '{}_{}'.format(int(time() * 1e6), uuid.uuid4().hex[:8])
+        fields = [field for field in shards[0] if field != 'offsets']
+        offsets = [shards[0]['offsets']]
+        for shard in shards[1:]:
+            offsets.append(shard['offsets'][1:] + offsets[-1][-1])
+        np.save(self.shard_file(name, 'offsets'), np.concatenate(offsets))
+        for field in fields:
+            np.save(self.shard_file(name, field), np.concatenate([shard[field] for shard in shards]))
+        with open(os.path.join(self.dir, name + '.json'), 'w') as f:
+            f.write(json.dumps(fields))
+
+        keys_file = self.shard_file(name, 'keys')
+        np.save(keys_file + '.tmp.npy', keys)
+        os.replace(keys_file + '.tmp.npy', keys_file)
+        self.load_shard(name)
+
+    def tokenize(self, text, tokenize, fields=None):
+        """
+        Returns the `fields` of the output of `tokenize(text)` as a dict of
+        per-text sequences, calling it only for the texts not in the cache.
+        """
+        fields = list(fields or self.fields)
+        hashes = text_hashes(text)
+        found = np.array([self.has(h, fields) for h in hashes], dtype=bool)
+        missing = np.flatnonzero(~found)
+        if len(text) == 0:
+            return {}
+
+        encoded = {field: [None] * len(text) for field in fields}
+        if len(missing) > 0:
+            new = tokenize([text[i] for i in missing])
+            new = {field: [list(sequence) for sequence in new[field]] for field in new}
+            # Every field is cached, so tokenizers needing more can reuse the entry
+            self.add(hashes[missing], new)
+            for field in fields:
+                for i, sequence in zip(missing, new[field]):
+                    encoded[field][i] = sequence
+
+        for i in np.flatnonzero(found):
+            cached = self.get(hashes[i])
+            for field in fields:
+                encoded[field][i] = cached[field]
+        return encoded
+
+    def corpus(self, key, build):
+        """
+        Returns the arrays cached under `key`, or builds them with `build()`,
+        which returns a dict of arrays, and caches them.
+        """
+        path = os.path.join(self.dir, f'corpus_{key}.npz')
+        if os.path.exists(path):
+            with np.load(path) as data:
+                return {field: data[field] for field in data.files}
+        arrays = build()
+        np.savez(path + '.tmp.npz', **arrays)
+        os.replace(path + '.tmp.npz', path)
+        return arrays
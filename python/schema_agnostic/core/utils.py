@@ -1,5 +1,4 @@
 import pandas as pd
-import torch
 
 vectorizers = ['word2vec', 'fasttext', 'glove',
                'bert', 'distilbert', 'roberta', 'xlnet', 'albert', 
@@ -42,6 +41,7 @@ def cosine_similarity(a, b, eps=1e-8):
     """
     added eps for numerical stability
     """
+    import torch
     a_n, b_n = a.norm(dim=1)[:, None], b.norm(dim=1)[:, None]
     a_norm = a / torch.clamp(a_n, min=eps)
     b_norm = b / torch.clamp(b_n, min=eps)
@@ -1,168 +1,674 @@
 #!/usr/bin/env python
-import numpy as np
-#from gensim.models import Word2Vec
-#from gensim.models import FastText
-from gensim.models.fasttext import load_facebook_model
-import gensim.downloader as api
-from transformers import BertTokenizer, BertModel
-from transformers import DistilBertTokenizer, DistilBertModel
-from transformers import RobertaTokenizer, RobertaModel
-from transformers import XLNetTokenizer, XLNetModel
-from sentence_transformers import SentenceTransformer
-from transformers import AlbertTokenizer, AlbertModel
-import transformers
-transformers.logging.set_verbosity_error()
-import torch
-
 from time import time
+import_started = time()
+import numpy as np
+from scipy import sparse
+from contextlib import nullcontext
 import os
-import pandas as pd
 import json
+from embedding_store import EmbeddingWriter, ColumnWriter, convert_store
+from model_registry import ModelRegistry, registry_settings
+from embedding_cache import EmbeddingCache, dedup, text_hashes, chunk_key
+from inference import resolve_device, set_threads, quantize, cosine_drift
+from encoding_pool import EncodingPool
+from pipeline import Producer, Consumer, stage_clocks
+from tokenization_cache import TokenizationCache, tokenizer_fingerprint
+from autotune import TuningCache, tune_batch_size, sample_texts
+from truncation import token_lengths, choose_max_length, length_profile
+from profiling import BatchProfiler, profile_path
+from vectorizers import get_vectorizer, lazy_import, plugins, timing_report
+# torch, transformers, sentence_transformers and gensim are imported by the
+# vectorizer plugins on first use
+import_time = time() - import_started
 
 
-def create_embeddings(text, vectorizer, log, log_file, output_path, output_index, 
-                      static_dir, b=500):
-   if vectorizer == 'word2vec':
-       init_time = time()
-       text2 = [t.split(' ') for t in text]
+# Sized by the environment or the machine, see registry_settings and
+# configure_registry
+registry = ModelRegistry(*registry_settings())
+
+# Open embedding and tokenization caches, so their key index is read once
+# per process
+embedding_caches = {}
+token_caches = {}
+
+revisions = {name: plugin.revision for name, plugin in plugins.items()}
+
+
+def load_tokenizer(vectorizer):
+   return get_vectorizer(vectorizer).load_tokenizer()
+
+
+def load_model(vectorizer, static_dir, device='cuda'):
+   # Static models are converted once to KeyedVectors under <static_dir>/kv/
+   # and memory-mapped, so concurrent processes share them
+   return get_vectorizer(vectorizer).load(static_dir, device)
+
+
+def load_onnx_model(vectorizer, static_dir, device='cpu', threads=None):
+   """
+   Returns the onnxruntime counterpart of load_model. Each encoder is
+   exported once to <static_dir>/onnx/ and the graph is reused afterwards.
+   """
+   return get_vectorizer(vectorizer).load_onnx(static_dir, device, threads)
+
+
+def average_word_vectors(text, voc, chunk_size=100000):
+   """
+   Averages the vectors of the in-vocabulary words of every sentence. Each
+   chunk of sentences is tokenized once, mapped to row ids through the key
+   index of `voc`, and reduced with a sparse (sentences x words) count matrix.
+   Returns the (sentences x dimensions) means and the in-vocabulary word
+   count of every sentence.
+   """
+   key_to_index = voc.key_to_index
+   vectors = np.zeros((len(text), voc.vector_size))
+   no_words = np.zeros(len(text), dtype=np.int64)
+   for i in range(0, len(text), chunk_size):
+       print(f'\r\t {i}/{len(text)}', end='')
+       temp_text = text[i:i+chunk_size]
        
-       vector_size = 300
-       model = api.load('word2vec-google-news-300')
-       voc = model        
-       init_time = time()-init_time
-            
-       vect_time = time()           
-       vectors = []
-       total_no_words = 0
-       for nos, sentence in enumerate(text2):
-           if nos % 1000 == 0:
-                print(f'\r\t {nos}/{len(text2)}', end='')
-           vector = np.zeros(vector_size)
-           no_words = 0
-           for word in sentence:
-               if word in voc:
-                   vector += voc[word]
-                   no_words += 1
-           if no_words > 0:
-               vector = vector / no_words
-               
-           total_no_words += no_words           
-           vectors.append(vector)
-       vectors = np.array(vectors)
-       vect_time = time()-vect_time
+       tokens = ' '.join(temp_text).split(' ')
+       lengths = [t.count(' ')+1 for t in temp_text]
+       ids = np.fromiter((key_to_index.get(token, -1) for token in tokens),
+                         dtype=np.int64, count=len(tokens))
+       rows = np.repeat(np.arange(len(temp_text)), lengths)
+       found = ids >= 0
+       ids, rows = ids[found], rows[found]
        
-       log['no_words'] = total_no_words / len(text2)
+       words, cols = np.unique(ids, return_inverse=True)
+       counts = sparse.csr_matrix((np.ones(len(ids)), (rows, cols)),
+                                  shape=(len(temp_text), len(words)))
+       temp_no_words = np.bincount(rows, minlength=len(temp_text))
+       temp_vectors = counts @ voc.vectors[words].astype(np.float64)
+       nonzero = temp_no_words > 0
+       temp_vectors[nonzero] /= temp_no_words[nonzero, None]
        
-       df = pd.DataFrame(vectors)
-       df.index = output_index
-       df.to_csv(output_path, index=True, header=False)
+       vectors[i:i+chunk_size] = temp_vectors
+       no_words[i:i+chunk_size] = temp_no_words
+   return vectors, no_words
+
+
+def encode_words(text, voc):
+   vectors = []
+   for nos, sentence in enumerate(text):        
+       if nos % 1000 == 0:
+            print(f'\r\t {nos}/{len(text)}', end='')                     
+       vectors.append(voc[sentence])
+   return np.array(vectors)
+
+
+def length_batches(lengths, token_budget):
+   """
+   Splits lengths sorted in ascending order into (start, end) batches whose
+   padded size, i.e. rows times the longest (last) length, fits in
+   token_budget. A single text longer than the budget gets its own batch.
+   """
+   batches = []
+   start = 0
+   for i, length in enumerate(lengths):
+       if i > start and (i - start + 1) * length > token_budget:
+           batches.append((start, i))
+           start = i
+   if start < len(lengths):
+       batches.append((start, len(lengths)))
+   return batches
+
+
+def tokenized_batches(text, tokenizer, max_length, token_budget, window=4096,
+                      token_cache=None):
+   """
+   Yields (positions, padded input, tokenization time) batches of `text`.
+   Texts are ordered by character length and tokenized `window` at a time,
+   through `token_cache` if given; within a window they are sorted by token
+   length and batched by token_budget, so every batch is padded only to its
+   longest member instead of max_length. The time of a window is shared
+   among its batches by rows.
+   """
+   def tokenize(texts):
+       return tokenizer(texts, truncation=True, max_length=max_length)
+   
+   order = np.argsort([len(t) for t in text], kind='stable')
+   for i in range(0, len(text), window):
+       t1 = time()
+       positions = order[i:i+window]
+       window_text = [text[j] for j in positions]
+       if token_cache is None:
+           encoded = tokenize(window_text)
+       else:
+           encoded = token_cache.tokenize(window_text, tokenize, tokenizer.model_input_names)
+       lengths = np.array([len(ids) for ids in encoded['input_ids']])
+       window_order = np.argsort(lengths, kind='stable')
+       window_time = time() - t1
+       for start, end in length_batches(lengths[window_order], token_budget):
+           t2 = time()
+           batch = window_order[start:end]
+           padded = tokenizer.pad({key: [values[j] for j in batch]
+                                   for key, values in encoded.items()},
+                                  return_tensors='pt')
+           yield positions[batch], padded, \
+               window_time * len(batch) / len(positions) + time() - t2
+
+
+def encode_transformer(text, tokenizer, model, max_length, token_budget, device='cuda',
+                       clocks=None, token_cache=None, profiler=None):
+   """
+   Returns the [CLS] vectors of `text`, in input order. A tokenizer thread
+   prepares the padded batches of tokenized_batches ahead of the model
+   through a bounded queue, so tokenization overlaps with the forward passes.
+   Every batch is recorded by the profiler, if given.
+   
+   Left-padded tokenizers, such as XLNet's, append [CLS] to every text, so
+   its vector is taken from the last position of every row, which holds
+   the real token whatever the padding of the batch.
+   """
+   clocks = clocks if clocks is not None else stage_clocks()
+   cls_index = -1 if tokenizer.padding_side == 'left' else 0
+   batches = Producer(tokenized_batches(text, tokenizer, max_length, token_budget,
+                                        token_cache=token_cache),
+                      clocks['tokenize'], consumer_clock=clocks['model'])
+   vectors = None
+   done = 0
+   try:
+       for positions, encoded_input, tokenize_time in batches:
+           with clocks['model'].busy():
+               print(f'\r\t {done}/{len(text)}', end='')
+               no, traced = profiler.next_batch() if profiler is not None else (None, False)
+               t1 = time()
+               with profiler.trace(no) if traced else nullcontext():
+                   encoded_input.to(device)
+                   output = model(**encoded_input)
+                   cls = output.last_hidden_state[:,cls_index,:]
+                   # Kernels run asynchronously, so they are waited for
+                   # to tell the forward pass from the copy
+                   if profiler is not None and device == 'cuda':
+                       lazy_import('torch').cuda.synchronize()
+                   t2 = time()
+                   temp_vectors = cls.detach().cpu().numpy()
+               t3 = time()
+               if profiler is not None:
+                   mask = encoded_input['attention_mask']
+                   profiler.record('batch', batch=no, rows=len(positions),
+                                   tokenize_time=tokenize_time, forward_time=t2-t1,
+                                   d2h_time=t3-t2, real_tokens=int(mask.sum()),
+                                   padded_tokens=int(mask.numel()))
+               if vectors is None:
+                   vectors = np.empty((len(text), temp_vectors.shape[1]), dtype=np.float32)
+               vectors[positions] = temp_vectors
+               done += len(positions)
+   finally:
+       batches.close()
+   return vectors
+
+
+def encode_sentence_transformer(text, model, b, batch_size=32, profiler=None):
+   vectors = []
+   total = len(range(0, len(text), b))
+   for i in range(0, len(text), b):
+       print(f'\r\t {i//b}/{total}', end='')
+       temp_text = text[i:i+b]
+       t1 = time()
+       vectors.append(model.encode(temp_text, batch_size=batch_size))
+       if profiler is not None:
+           # encode() tokenizes, runs and copies back in one call
+           profiler.record('batch', batch=profiler.next_batch()[0], rows=len(temp_text),
+                           encode_time=time()-t1)
+   return np.concatenate(vectors)
+
+
+def encode_texts(model, text, vectorizer, b, max_length, device, clocks=None,
+                 token_cache=None, batch_size=32, profiler=None):
+   """
+   Encodes `text` with a model returned by get_model, in input order. The
+   time spent is added to the stage clocks, if given. `b` bounds the rows
+   of a BERT-family batch; SentenceTransformers encode slices of `b` texts
+   in batches of `batch_size`.
+   """
+   clocks = clocks if clocks is not None else stage_clocks()
+   kind = get_vectorizer(vectorizer).kind
+   if kind == 'static':
+       with clocks['model'].busy():
+           return encode_words(text, model)
+   with lazy_import('torch').inference_mode():
+       if kind == 'transformer':
+           tokenizer, transformer = model
+           return encode_transformer(text, tokenizer, transformer, max_length,
+                                     token_budget=b*max_length, device=device,
+                                     clocks=clocks, token_cache=token_cache,
+                                     profiler=profiler)
+       with clocks['model'].busy():
+           return encode_sentence_transformer(text, model, b, batch_size, profiler)
+
+
+def get_model(vectorizer, static_dir, device, int8=False, backend='torch', threads=None):
+   """
+   Returns (model, init_time, saved_time) from the registry. The int8
+   variant is quantized from the fp32 CPU model, which stays registered.
+   """
+   if backend == 'onnx':
+       def loader():
+           return load_onnx_model(vectorizer, static_dir, device, threads)
+   elif int8:
+       def loader():
+           return quantize(get_model(vectorizer, static_dir, 'cpu')[0])
+   else:
+       def loader():
+           return load_model(vectorizer, static_dir, device)
+   return registry.get((vectorizer, device, int8, backend), loader)
+
+
+def get_embedding_cache(cache_dir, vectorizer, revision, max_length):
+   """Returns the embedding cache of a vectorizer, opened on first use and shared by later calls."""
+   key = (cache_dir, vectorizer, revision, max_length)
+   if key not in embedding_caches:
+       embedding_caches[key] = EmbeddingCache(cache_dir, vectorizer, revision, max_length)
+   return embedding_caches[key]
+
+
+def get_token_cache(vectorizer, model, static_dir, max_length):
+   """
+   Returns the tokenization cache of a model returned by get_model, opened
+   on first use and shared with every later call and every model whose
+   tokenizer is identical, or None if it has none.
+   """
+   if get_vectorizer(vectorizer).kind != 'transformer':
+       return None
+   key = (static_dir, tokenizer_fingerprint(model[0]), max_length)
+   if key not in token_caches:
+       token_caches[key] = TokenizationCache(static_dir+'tokenization_cache/', model[0], max_length)
+   return token_caches[key]
+
+
+def configure_registry(max_models=None, memory_budget=None):
+   """Sets the model count and memory budget (bytes) of the registry, e.g. from arguments."""
+   registry.configure(max_models, memory_budget)
+
+
+def registry_stats(vectorizer):
+   """Sums the registry statistics of every variant of `vectorizer`."""
+   stats = {'loads': 0, 'hits': 0, 'init_time': 0.0, 'saved_time': 0.0}
+   for key, key_stats in registry.stats.items():
+       if key[0] == vectorizer:
+           for stat in stats:
+               stats[stat] += key_stats[stat]
+   return stats
+
+
+def iter_chunks(text, index, chunk_size):
+   """Splits aligned texts and ids into (texts, index) chunks."""
+   for i in range(0, len(text), chunk_size):
+       yield text[i:i+chunk_size], index[i:i+chunk_size]
+
+
+def run_config(vectorizer, device, int8=False, backend='torch', max_length_percentile=None,
+               columns=None):
+   """
+   Returns the settings that determine the vectors of a run. Static models
+   always run in gensim and dynamic quantization only exists for torch
+   models on CPU. An adaptive max_length is recorded by its percentile,
+   as the length it picks for a dataset is kept (see create_embeddings).
+   The [CLS] position of encoders that do not put it first is recorded too,
+   and so are the ordered `columns` of a multi-column run, which make up
+   the rows of a combined store.
+   """
+   plugin = get_vectorizer(vectorizer)
+   kind = plugin.kind
+   if kind == 'static':
+       backend = 'gensim'
+   int8 = int8 and device == 'cpu' and backend == 'torch'
+   config = {'vectorizer': vectorizer, 'revision': revisions[vectorizer],
+             'backend': backend, 'int8': int8}
+   if max_length_percentile is not None and kind == 'transformer':
+       config['max_length_percentile'] = max_length_percentile
+   if kind == 'transformer' and plugin.cls_position != 'first':
+       config['cls_position'] = plugin.cls_position
+   if columns is not None:
+       config['columns'] = list(columns)
+   return config
+
+
+def create_embeddings(text, vectorizer, log, log_file, output_path, output_index, 
+                      static_dir, b=500, use_cache=True, chunk_size=100000,
+                      device=None, threads=None, int8=False, drift_sample=64,
+                      backend='torch', workers=1, resume=True, autotune=False,
+                      memory_cap=None, autotune_sample=1024, profile=False,
+                      trace_batch=None, timing=False, columns=None,
+                      max_length_percentile=None, max_length_sample=2000, storage=(),
+                      write_log=True):
+   """
+   Encodes `text` into the store at `output_path`. `text` is either a list
+   aligned with `output_index`, or, when `output_index` is None, an iterable
+   of (texts, index) chunks that is consumed lazily, so only one chunk is
+   held in memory at a time.
+   
+   With `columns`, the texts of every chunk are those of several columns in
+   turn and are written by a ColumnWriter to `output_path`, one store per
+   column or a single one (see create_column_embeddings).
+   
+   With `resume`, every chunk is checkpointed once written and an output
+   left by an earlier run with the same settings is resumed after its last
+   chunk that still matches the input. An output that is already complete
+   is left as is, without loading the model or writing a log line.
+   
+   With `autotune`, the batch size is chosen by probing a sample of the
+   first chunk to encode (see tune_batch_size), within `memory_cap` bytes
+   of RSS, and the choice is kept in <static_dir>/autotune.json.
+   
+   With `profile`, the stages of every batch and chunk are appended to
+   <log_file base>.profile.jsonl (see BatchProfiler), and batch number
+   `trace_batch` of a BERT-family model is traced with torch.profiler into
+   <log_file dir>/traces/.
+   
+   With `max_length_percentile`, BERT-family models truncate at the smallest
+   max_length that covers that percentile of the token lengths of a sample
+   of the first chunk to encode, instead of 100. The choice is kept in
+   <static_dir>/max_length.json per dataset and tokenizer, so models with an
+   identical tokenizer and resumed runs use the same length.
+   
+   `storage` lists extra formats, 'float16' and/or 'int8', into which the
+   float32 output is converted once complete (see convert_store).
+   
+   With `timing`, the cold-start time of the run (see timing_report) is
+   logged under `cold_start`.
+   
+   Without `write_log`, `log` is only filled in, for the caller to write.
+   """
+   if output_index is None:
+       chunks = iter(text)
+   else:
+       chunks = iter_chunks(text, output_index, chunk_size)
+   
+   plugin = get_vectorizer(vectorizer)
+   # Static models run in numpy, so they do not need torch to pick a device
+   device = 'cpu' if plugin.kind == 'static' else resolve_device(device)
+   if device == 'cpu' and plugin.kind != 'static':
+       log['threads'] = set_threads(threads)
+   config = run_config(vectorizer, device, int8, backend, max_length_percentile, columns)
+   backend, int8 = config['backend'], config['int8']
+   log['device'] = device
+   log['backend'] = backend
+   log['int8'] = int8
+   
+   # SentenceTransformers truncate to their own max_seq_length
+   max_length = plugin.max_length if plugin.kind == 'transformer' else None
+   if plugin.kind != 'static':
+       b = plugin.b
+   
+   batch_size = 32
+   
+   # On CPU, transformer models can be sharded over a pool of processes,
+   # which load their own copy of the model instead of this process
+   pool = None
+   model, init_time, saved_time = None, 0.0, 0.0
+   cache, token_cache = None, None
+   clocks = stage_clocks()
+   profiler = None
+   if profile:
+       context = {key: log[key] for key in ['dir', 'file', 'vectorizer'] if key in log}
+       name = os.path.basename(output_path if isinstance(output_path, str) else output_path[0])
+       context['output'] = name
+       profiler = BatchProfiler(profile_path(log_file), context, trace_batch,
+                                os.path.join(os.path.dirname(log_file), 'traces'), name)
+   
+   def encode(model, texts, clocks=None, profiler=None):
+       clocks = clocks if clocks is not None else stage_clocks()
+       if pool is not None:
+           with clocks['model'].busy():
+               return pool.encode(texts)
+       return encode_texts(model, texts, vectorizer, b, max_length, device, clocks,
+                           token_cache, batch_size, profiler)
+   
+   def tune(text):
+       nonlocal b, batch_size
+       # BERT-family batches are bounded by b, SentenceTransformers by batch_size
+       if plugin.kind == 'transformer':
+           parameter, candidates = 'b', [4, 8, 16, 32, 64, 128]
+       else:
+           parameter, candidates = 'batch_size', [16, 32, 64, 128, 256, 512]
+       
+       def probe(texts, value):
+           if parameter == 'b':
+               return encode_texts(model, texts, vectorizer, value, max_length, device)
+           return encode_texts(model, texts, vectorizer, b, max_length, device,
+                               batch_size=value)
+       
+       tuning = TuningCache(static_dir + 'autotune.json')
+       key = '|'.join(str(setting) for setting in
+                      [vectorizer, output_path, device, backend, int8, memory_cap])
+       choice = tuning.get(key)
+       cached = choice is not None
+       if not cached:
+           sample = sample_texts(dedup(text)[0], autotune_sample)
+           value, probes = tune_batch_size(probe, sample, candidates, memory_cap)
+           choice = {'parameter': parameter, 'value': value,
+                     'sample': len(sample), 'probes': probes}
+           tuning.put(key, choice)
+           print()
+       if parameter == 'b':
+           b = choice['value']
+       else:
+           batch_size = choice['value']
+       log['autotune'] = dict(choice, cached=cached, memory_cap=memory_cap)
+   
+   def adapt_max_length(text):
+       nonlocal max_length
+       tokenizer = plugin.load_tokenizer()
+       # The dataset is told by the file being encoded, if the caller logs it
+       dataset = [log[key] for key in ['dir', 'file'] if key in log] or [output_path]
+       key = '|'.join(str(setting) for setting in
+                      dataset + [tokenizer_fingerprint(tokenizer), max_length_percentile])
+       choices = TuningCache(static_dir + 'max_length.json')
+       choice = choices.get(key)
+       cached = choice is not None
+       if not cached:
+           lengths = token_lengths(dedup(text)[0], tokenizer, max_length_sample)
+           upper = min(512, tokenizer.model_max_length)
+           value = choose_max_length(lengths, max_length_percentile, upper=upper)
+           choice = dict(length_profile(lengths, value), max_length=value)
+           choices.put(key, choice)
+       max_length = choice['max_length']
+       log['max_length'] = dict(choice, percentile=max_length_percentile, cached=cached)
+   
+   def setup(text):
+       nonlocal pool, model, init_time, saved_time, cache, token_cache
+       if max_length_percentile is not None and plugin.kind == 'transformer':
+           adapt_max_length(text)
+       if workers > 1 and device == 'cpu' and plugin.kind != 'static':
+           init_time = time()
+           pool = EncodingPool(workers, vectorizer, static_dir, b, max_length,
+                               int8, backend, threads, use_cache=use_cache)
+           init_time = time() - init_time
+       else:
+           model, init_time, saved_time = get_model(vectorizer, static_dir, device, int8,
+                                                    backend, threads)
+           if use_cache:
+               token_cache = get_token_cache(vectorizer, model, static_dir, max_length)
        
-   elif vectorizer == 'fasttext': 
-       init_time = time()
-       model = load_facebook_model(static_dir+'fasttext/wiki.en.bin')
-       voc = model.wv
-       init_time = time()-init_time
-            
-       vect_time = time()           
-       vectors = []
-       for nos, sentence in enumerate(text):        
-           if nos % 1000 == 0:
-                print(f'\r\t {nos}/{len(text)}', end='')                     
-           vectors.append(voc[sentence])
-       vectors = np.array(vectors)
-       vect_time = time()-vect_time
+       if autotune and pool is None and plugin.kind != 'static':
+           tune(text)
        
-       df = pd.DataFrame(vectors)
-       df.index = output_index
-       df.to_csv(output_path, index=True, header=False)      
-   
-   elif vectorizer in ['bert', 'distilbert', 'roberta', 'xlnet', 'albert']:
-       b = 10
-       init_time = time()
-       if vectorizer == 'bert':
-           tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-           model = BertModel.from_pretrained("bert-base-uncased")
-       elif vectorizer == 'distilbert':
-           tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased')
-           model = DistilBertModel.from_pretrained("distilbert-base-uncased")            
-       elif vectorizer == 'roberta':
-           tokenizer = RobertaTokenizer.from_pretrained('roberta-base')
-           model = RobertaModel.from_pretrained('roberta-base')
-       elif vectorizer == 'xlnet':
-           tokenizer = XLNetTokenizer.from_pretrained('xlnet-base-cased')
-           model = XLNetModel.from_pretrained('xlnet-base-cased')                
-       elif vectorizer == 'albert':
-           tokenizer = AlbertTokenizer.from_pretrained('albert-base-v2')
-           model = AlbertModel.from_pretrained("albert-base-v2")  
-       model.cuda()           
-       init_time = time() - init_time
+       if int8 and pool is None:
+           # Encode a sample with both variants, so the speedup can be weighed
+           # against the drift of the int8 vectors. Both tokenize the sample
+           # themselves, as the token cache would only serve the second one
+           sample = dedup(text)[0][:drift_sample]
+           reference, _, _ = get_model(vectorizer, static_dir, device)
+           t1 = time()
+           reference = encode_texts(reference, sample, vectorizer, b, max_length, device,
+                                    batch_size=batch_size)
+           t2 = time()
+           vectors = encode_texts(model, sample, vectorizer, b, max_length, device,
+                                  batch_size=batch_size)
+           t3 = time()
+           log['quantization'] = cosine_drift(reference, vectors)
+           log['quantization']['sample'] = len(sample)
+           log['quantization']['speedup'] = (t2-t1) / (t3-t2) if t3 > t2 else None
+           print()
        
-       vect_time = 0
-       with open(output_path, 'w') as o:
-           total = len(range(0, len(text), b))
-           for i in range(0, len(text), b):
-               print(f'\r\t {i//b}/{total}', end='')
-               t1 = time()
-               temp_text = text[i:i+b]
-               temp_index = output_index[i:i+b]
-               encoded_input = tokenizer(temp_text, return_tensors='pt', truncation=True,
-                                         max_length=100, padding='max_length')
-               encoded_input.to("cuda")
-               output = model(**encoded_input)
-               vectors = output.last_hidden_state[:,0,:]
-               t2 = time()
-               vect_time += t2-t1
-               
-               #flushing
-               vectors = vectors.detach().cpu().numpy()
-               df = pd.DataFrame(vectors)
-               df.index = temp_index
-               df.to_csv(o, index=True, header=False)
-
-   elif vectorizer in ['smpnet', 'st5', 'glove',
-                       'sdistilroberta', 'sminilm']:
-       b = 500
-       init_time = time()
-       device = torch.device('cuda')
-       #device = torch.device('cpu')
-       if vectorizer == 'smpnet':
-           model = SentenceTransformer('all-mpnet-base-v2', device=device)
-       elif vectorizer == 'st5':
-           model = SentenceTransformer('gtr-t5-base', device=device)
-           #model = SentenceTransformer('gtr-t5-large', device=device)           
-       elif vectorizer == 'sdistilroberta':
-           model = SentenceTransformer('all-distilroberta-v1', device=device)
-       elif vectorizer == 'sminilm':
-           model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
-           #model = SentenceTransformer('all-MiniLM-L12-v2', device=device)                       
-       elif vectorizer == 'glove':
-           model = SentenceTransformer('average_word_embeddings_glove.6B.300d', device=device)
-       init_time = time() - init_time
+       # Word averaging is cheaper than a cache lookup and its no_words statistic
+       # needs every text, so word2vec only deduplicates within each chunk
+       if use_cache and vectorizer != 'word2vec':
+           revision = revisions[vectorizer] + ('-int8' if int8 else '') + \
+               ('-onnx' if backend == 'onnx' else '') + \
+               ('-cls_' + plugin.cls_position if plugin.kind == 'transformer'
+                and plugin.cls_position != 'first' else '')
+           cache = get_embedding_cache(static_dir+'embedding_cache/', vectorizer,
+                                       revision, max_length)
+   
+   vect_time = 0
+   total_no_words = 0
+   no_unique, no_cached, no_resumed = 0, 0, 0
+   loaded = False
+   vectors = None
+   width = len(columns) if columns is not None else 1
+   if columns is not None:
+       o = ColumnWriter(output_path, columns, config=config if resume else None)
+   else:
+       o = EmbeddingWriter(output_path, config=config if resume else None)
+   with o:
+       # Chunks are added to the cache and written by a separate thread,
+       # while the next one is being encoded
+       def flush(item):
+           hashes, new_vectors, vectors, index, key = item
+           t1 = time()
+           if cache is not None:
+               cache.add(hashes, new_vectors)
+           t2 = time()
+           o.write(vectors, index, key)
+           if profiler is not None:
+               profiler.record('write', rows=len(vectors), cache_time=t2-t1,
+                               serialize_time=time()-t2)
+       writer = Consumer(flush, clocks['write'], producer_clock=clocks['model'])
        
-       vect_time = 0
-       with open(output_path, 'w') as o:
-           total = len(range(0, len(text), b))
-           for i in range(0, len(text), b):
-               print(f'\r\t {i//b}/{total}', end='')
+       try:
+           for temp_text, temp_index in chunks:
+               temp_text = list(temp_text)
+               key = chunk_key(temp_text, temp_index, width) if resume else None
+               if resume and o.resume(temp_index, key):
+                   no_resumed += len(temp_index)
+                   continue
+           
+               # Models are loaded for the first chunk to encode, so complete
+               # outputs are skipped without loading them
+               if not loaded:
+                   setup(temp_text)
+                   loaded = True
+           
                t1 = time()
-               temp_text = text[i:i+b]
-               temp_index = output_index[i:i+b]
-               vectors = model.encode(temp_text)
+               unique, inverse = dedup(temp_text)
+               no_unique += len(unique)
+           
+               if cache is not None:
+                   hashes = text_hashes(unique)
+                   found, cached = cache.lookup(hashes)
+                   missing = [unique[j] for j in np.flatnonzero(~found)]
+                   no_cached += int(found.sum())
+               else:
+                   found = np.zeros(len(unique), dtype=bool)
+                   missing = unique
+           
+               if len(missing) == 0:
+                   new_vectors = None
+               elif vectorizer == 'word2vec':
+                   with clocks['model'].busy():
+                       new_vectors, no_words = average_word_vectors(missing, model)
+                   total_no_words += (no_words[inverse]).sum()
+               else:
+                   new_vectors = encode(model, missing, clocks, profiler)
+           
+               dimensions = new_vectors.shape[1] if new_vectors is not None else cached.shape[1]
+               vectors = np.empty((len(unique), dimensions), dtype=np.float32)
+               if new_vectors is not None:
+                   vectors[~found] = new_vectors
+               if found.any():
+                   vectors[found] = cached
+               vectors = vectors[inverse]
                t2 = time()
                vect_time += t2-t1
+               if profiler is not None:
+                   profiler.record('chunk', rows=len(temp_text), unique=len(unique),
+                                   cached=int(found.sum()), encode_time=t2-t1)
            
                #flushing
-               df = pd.DataFrame(vectors)
-               df.index = temp_index
-               df.to_csv(o, index=True, header=False)
-              
-    
-
+               writer.put((hashes[~found] if cache is not None else None, new_vectors,
+                           vectors, temp_index, key))
+       finally:
+           # Workers are stopped whether or not encoding or writing failed
+           try:
+               writer.close()
+           finally:
+               if pool is not None:
+                   pool.close()
+       rows = o.rows
+       dimensions = o.dimensions
+   
+   if pool is not None:
+       log['workers'] = pool.worker_stats()
+   if token_cache is not None:
+       token_cache.flush()
+   if profiler is not None:
+       profiler.close()
+   outputs = [output_path] if isinstance(output_path, str) else output_path
+   for path in outputs:
+       for fmt in storage:
+           convert_store(path, fmt)
+   if not loaded and rows > 0:
+       print('\t already complete', end='')
+       return vectors
+   
+   encoded = (rows - no_resumed) * width
+   if vectorizer == 'word2vec':
+       log['no_words'] = float(total_no_words / encoded) if encoded > 0 else None
+   log['rows'] = rows
+   log['resumed_rows'] = no_resumed
+   log['sentences_per_sec'] = encoded / vect_time if vect_time > 0 else None
+   log['unique_texts'] = no_unique
+   log['cached_texts'] = no_cached
    log['init_time'] = init_time   
+   log['saved_init_time'] = saved_time
    log['time'] = vect_time
-   log['dimensions'] = vectors.shape[1]
+   log['dimensions'] = dimensions
+   log['b'] = b
+   log['batch_size'] = batch_size
+   log['pipeline'] = {stage: clock.stats() for stage, clock in clocks.items()}
+   if timing:
+       log['cold_start'] = timing_report(import_time, init_time)
+       print('\n\t cold start {:.2f}s: import {:.2f}s, dependencies {:.2f}s, model {:.2f}s'.format(
+           log['cold_start']['total'], import_time,
+           sum(log['cold_start']['imports'].values()), init_time), end='')
     
-   with open(log_file, 'a') as f:
-       f.write(json.dumps(log)+"\n")
+   if write_log:
+       with open(log_file, 'a') as f:
+           f.write(json.dumps(log)+"\n")
+   
+   return vectors
+
+
+def create_column_embeddings(columns, vectorizer, log, log_file, output_path, output_index,
+                             static_dir, chunk_size=100000, **kwargs):
+   """
+   Encodes several text columns of one table, a dict of lists aligned with
+   `output_index`, in a single pass: each chunk of rows is encoded as one
+   stream of the texts of every column, so the model is set up once and a
+   text found in two columns is encoded once. `output_path` is either a
+   list with a store per column, or a single store of the columns side by
+   side. Takes the keyword arguments of create_embeddings.
    
+   The log keeps one record per column, as when columns were encoded one
+   at a time: `log['columns']`, if given, lists the `column` entry of each
+   record, and the measurements of the shared pass are repeated in every
+   record, which names the columns of the pass in `pass_columns`.
+   """
+   names = list(columns)
+   def chunks():
+       for i in range(0, len(output_index), chunk_size):
+           texts = [t for name in names for t in columns[name][i:i+chunk_size]]
+           yield texts, output_index[i:i+chunk_size]
+   records = log.pop('columns', None) or [{'name': name} for name in names]
+   vectors = create_embeddings(chunks(), vectorizer, log, log_file, output_path, None,
+                               static_dir, columns=names, write_log=False, **kwargs)
+   # An output found complete is skipped without measurements and gets no record
+   if 'time' in log:
+       with open(log_file, 'a') as f:
+           for record in records:
+               f.write(json.dumps(dict(log, column=record, pass_columns=names))+"\n")
    return vectors
@@ -1,5 +1,6 @@
+import numpy as np
 import pandas as pd
-from vectorization import create_embeddings
+from vectorization import create_embeddings, configure_registry
 import sys
 import os
 from utils import vectorizers
@@ -9,35 +10,82 @@ input_dir = sys.argv[1]
 output_dir = sys.argv[2]
 log_file = sys.argv[3] + 'vectorization_synthetic.txt'    
 static_dir = sys.argv[4]    
+device = 'cpu' if '--cpu' in sys.argv else None
+int8 = '--int8' in sys.argv
+backend = 'onnx' if '--onnx' in sys.argv else 'torch'
+resume = '--restart' not in sys.argv
+autotune = '--autotune' in sys.argv
+memory_cap = float(sys.argv[sys.argv.index('--memory-cap')+1]) * 1024**3 if '--memory-cap' in sys.argv else None
+# Models kept warm across files and their memory budget (GB), see registry_settings
+max_models = int(sys.argv[sys.argv.index('--max-models')+1]) if '--max-models' in sys.argv else None
+model_memory = float(sys.argv[sys.argv.index('--model-memory')+1]) * 1024**3 if '--model-memory' in sys.argv else None
+configure_registry(max_models, model_memory)
+profile = '--profile' in sys.argv or '--trace-batch' in sys.argv
+trace_batch = int(sys.argv[sys.argv.index('--trace-batch')+1]) if '--trace-batch' in sys.argv else None
+timing = '--timing' in sys.argv
+max_length_percentile = float(sys.argv[sys.argv.index('--max-length-percentile')+1]) if '--max-length-percentile' in sys.argv else None
+storage = sys.argv[sys.argv.index('--storage')+1].split(',') if '--storage' in sys.argv else []
+workers = int(sys.argv[sys.argv.index('--workers')+1]) if '--workers' in sys.argv else 1
+chunk_size = 100000
 
 files = ['10K.csv', '50K.csv', '100K.csv', '200K.csv', '300K.csv', '1M.csv', '2M.csv']
 
-for file in files:
-    df = pd.read_csv(input_dir+file, sep="|", index_col=0)
-    df = df.fillna('')
-    df = df.apply(lambda x: ' '.join([str(xx) for xx in x]), axis=1)
-    print(file, df.shape)
-    
-    for vectorizer in vectorizers:
-        print(vectorizer)
 
-        text = df.tolist()
-        
-        path2 = output_dir+file
-        path2 = path2.replace('.csv', f'_aggregated_{vectorizer}.csv')
-        
-        os.makedirs(os.path.dirname(path2), exist_ok=True)
-        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+def aggregated_chunks(file, lengths):
+    """
+    Reads `file` chunk_size profiles at a time and yields (texts, index)
+    chunks of their aggregated attribute values; the text lengths are
+    collected into `lengths` for the column statistics. Values are read as
+    strings, so their text does not depend on the dtype inferred per chunk.
+    """
+    columns = pd.read_csv(input_dir+file, sep="|", nrows=0).columns
+    dtype = {column: str for column in columns[1:]}
+    for df in pd.read_csv(input_dir+file, sep="|", index_col=0, dtype=dtype,
+                          chunksize=chunk_size):
+        df = df.fillna('')
+        text = df.iloc[:, 0].str.cat([df[c] for c in df.columns[1:]], sep=' ')
+        lengths.append(text.str.len().values)
+        yield text.tolist(), df.index
+
+
+# The guard keeps the spawned encoding workers from re-running the script
+if __name__ == '__main__':
+    for file in files:
+        print(file)
         
-        log = {}
-        #log['dir'] = dir
-        log['file'] = file
-        log['vectorizer'] = vectorizer
-        log['column'] = {'name': 'aggregated',
-                          'stats': df.apply(len).describe().to_dict()}
-                
-        embeddings = create_embeddings(text, vectorizer, log, log_file,
-                                       path2, df.index, static_dir)
-        print()
+        for vectorizer in vectorizers:
+            print(vectorizer)
+            
+            path2 = output_dir+file
+            path2 = path2.replace('.csv', f'_aggregated_{vectorizer}')
+            
+            os.makedirs(os.path.dirname(path2), exist_ok=True)
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            
+            log = {}
+            #log['dir'] = dir
+            log['file'] = file
+            log['vectorizer'] = vectorizer
+            
+            # The profiles are streamed, so the column statistics are filled
+            # in once the last chunk is read, before the log is written
+            lengths = []
+            def chunks():
+                yield from aggregated_chunks(file, lengths)
+                log['column'] = {'name': 'aggregated',
+                                 'stats': pd.Series(np.concatenate(lengths)).describe().to_dict()}
+            
+            # Synthetic profiles rarely repeat, so the text and token caches
+            # would only grow with the dataset, in memory and on disk
+            embeddings = create_embeddings(chunks(), vectorizer, log, log_file,
+                                           path2, None, static_dir, use_cache=False,
+                                           device=device, int8=int8, backend=backend,
+                                           workers=workers, resume=resume,
+                                           autotune=autotune, memory_cap=memory_cap,
+                                           profile=profile, trace_batch=trace_batch,
+                                           timing=timing,
+                                           max_length_percentile=max_length_percentile,
+                                           storage=storage)
+            print()
+            #break
         #break
-    #break
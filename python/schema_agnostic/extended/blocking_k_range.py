@@ -8,6 +8,8 @@ import json
 from utils import vectorizers, cases
 import sys
 import os
+from embedding_store import load_embeddings
+from candidates import CandidatePairs
 
 input_dir = sys.argv[1]
 emb_dir = sys.argv[2]
@@ -25,7 +27,7 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
     
     ground_file = '{}{}/{}.csv'.format(input_dir, dir, ground_file)
     ground_df = pd.read_csv(ground_file, sep=sep)
-    ground_results = set(ground_df.apply(lambda x: (x[0], x[1]), axis=1).values)
+    ground_results = CandidatePairs.from_ground_truth(ground_df)
     
     for nocol, (col1, col2) in enumerate(cols):
         if nocol != 2:
@@ -33,11 +35,11 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
         
         
         for vec in vectorizers:
-            file1 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data1, col1, vec)
-            file2 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data2, col2, vec)
+            file1 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data1, col1, vec)
+            file2 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data2, col2, vec)
             
-            df1 = torch.Tensor(pd.read_csv(file1, header=None, index_col=0).values)
-            df2 = torch.Tensor(pd.read_csv(file2, header=None, index_col=0).values)
+            df1 = torch.Tensor(load_embeddings(file1)[1])
+            df2 = torch.Tensor(load_embeddings(file2)[1])
             
             #reversed: input2query
             tensor11 = torch.Tensor(df2).cuda()
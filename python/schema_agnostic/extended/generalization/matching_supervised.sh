@@ -16,6 +16,8 @@ SEED=22
 data_dir="$1"
 log_dir="$2"
 exp_dir="$3"
+# optional: truncate at the length covering this percentile of token lengths, instead of max_lengths
+percentile="$4"
 
 model_types=('roberta' 'bert' 'distilbert' 'sdistilroberta' 'sminilm' 'albert' 'smpnet' 'xlnet')
 model_names=('roberta-base' 'bert-base-uncased' 'distilbert-base-uncased' 'sentence-transformers/all-distilroberta-v1' 'sentence-transformers/all-MiniLM-L6-v2' 'albert-base-v2' 'sentence-transformers/all-mpnet-base-v2' 'xlnet-base-cased')
@@ -27,6 +29,6 @@ max_lengths=(180 265 150 180 128)
 for j in "${!model_types[@]}"; do
         for i in "${!data_names[@]}"; do
                 cecho "YELLOW" "Start ${data_dirs[i]} ${model_types[j]}"
-                python3 supervised_main.py --model_type=${model_types[j]} --model_name_or_path=${model_names[j]} --data_dir=${data_dir}  --log_dir=${log_dir} --exp_dir=${exp_dir}  --data_name=${data_names[i]} --train_batch_size=16 --eval_batch_size=16 --max_seq_length=${max_lengths[i]} --num_epochs=15.0 --seed=${SEED}
+                python3 supervised_main.py --model_type=${model_types[j]} --model_name_or_path=${model_names[j]} --data_dir=${data_dir}  --log_dir=${log_dir} --exp_dir=${exp_dir}  --data_name=${data_names[i]} --train_batch_size=16 --eval_batch_size=16 --max_seq_length=${max_lengths[i]} --num_epochs=15.0 --seed=${SEED} ${percentile:+--max_length_percentile=${percentile}}
         done
 done
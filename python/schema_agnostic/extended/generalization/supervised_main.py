@@ -6,7 +6,7 @@ import json
 from supervised_utils import build_optimizer, initialize_gpu_seed, load_data, DataType, \
                              DeepMatcherProcessor, train, predict,  setup_logging, \
                              read_arguments_train, write_config_to_file, \
-                             Config, Evaluation, save_model
+                             Config, Evaluation, save_model, adaptive_max_length
 from time import time
 
 setup_logging()
@@ -59,13 +59,19 @@ if __name__ == "__main__":
 
     train_examples = processor.get_train_examples(args.data_path)
 
+    train_length_profile = None
+    if args.max_length_percentile is not None:
+        args.max_seq_length, train_length_profile = adaptive_max_length(
+            train_examples, tokenizer, args.model_type, args.max_length_percentile)
+
 
     training_data_loader = load_data(train_examples,
                                      label_list,
                                      tokenizer,
                                      args.max_seq_length,
                                      args.train_batch_size,
-                                     DataType.TRAINING, args.model_type)
+                                     DataType.TRAINING, args.model_type,
+                                     cache_dir=args.tokenization_cache_dir)
     logging.info("loaded {} training examples".format(len(train_examples)))
 
     num_train_steps = len(training_data_loader) * args.num_epochs
@@ -84,7 +90,8 @@ if __name__ == "__main__":
                                        tokenizer,
                                        args.max_seq_length,
                                        args.eval_batch_size,
-                                       DataType.EVALUATION, args.model_type)
+                                       DataType.EVALUATION, args.model_type,
+                                       cache_dir=args.tokenization_cache_dir)
 
     evaluation = Evaluation(evaluation_data_loader, exp_name, args.model_output_dir, len(label_list), args.model_type)
     logging.info("loaded and initialized evaluation examples {}".format(len(eval_examples)))
@@ -109,6 +116,11 @@ if __name__ == "__main__":
     for data_name, max_length in zip(data_names, max_lengths):
         args.data_path = os.path.join(args.data_dir, data_name)
         test_examples = processor.get_test_examples(args.data_path)
+        
+        length_profile = None
+        if args.max_length_percentile is not None:
+            max_length, length_profile = adaptive_max_length(
+                test_examples, tokenizer, args.model_type, args.max_length_percentile)
     
         logging.info("loaded {} test examples".format(len(test_examples)))
         test_data_loader = load_data(test_examples,
@@ -116,7 +128,8 @@ if __name__ == "__main__":
                                      tokenizer,
                                      max_length,
                                      args.eval_batch_size,
-                                     DataType.TEST, args.model_type)
+                                     DataType.TEST, args.model_type,
+                                     cache_dir=args.tokenization_cache_dir)
     
         include_token_type_ids = False
         if args.model_type == 'bert':
@@ -141,7 +154,9 @@ if __name__ == "__main__":
         with open(log_file, 'a') as fout:
             scores = {'simple_accuracy': simple_accuracy, 'f1': f1, 'model_type': args.model_type,
              'train_data_name': args.data_name, 'test_data_name': data_name, 
-             'training_time': training_time, 'testing_time': testing_time, 'prfs': prfs}
+             'training_time': training_time, 'testing_time': testing_time, 'prfs': prfs,
+             'train_max_length': args.max_seq_length, 'max_length': max_length,
+             'train_length_profile': train_length_profile, 'length_profile': length_profile}
             fout.write(json.dumps(scores)+"\n")
     
  
@@ -14,6 +14,8 @@ from pytorch_transformers import AdamW, WarmupLinearSchedule
 from transformers import AutoConfig, AutoTokenizer, AutoModelForSequenceClassification, \
     AlbertConfig, AlbertForSequenceClassification, AlbertTokenizer, \
     T5Config, T5Tokenizer, T5ForConditionalGeneration
+from tokenization_cache import TokenizationCache, corpus_key
+from truncation import sample_rows, choose_max_length, length_profile
 
 
 
@@ -62,33 +64,52 @@ class DataType(Enum):
     TEST = "Test"
 
 
-def load_data(examples, label_list, tokenizer, max_seq_length, batch_size, data_type: DataType, model_type):
-    logging.info("***** Convert Data to Features (Word-Piece Tokenizing) [{}] *****".format(data_type))
-    
-    features = convert_examples_to_features(examples,
-                                            label_list,
-                                            max_seq_length,
-                                            tokenizer,
-                                            output_mode="classification",
-                                            cls_token_at_end=bool(model_type in ['xlnet']),
-                                            # xlnet has a cls token at the end
-                                            cls_token=tokenizer.cls_token,
-                                            cls_token_segment_id=2 if model_type in ['xlnet'] else 0,
-                                            sep_token=tokenizer.sep_token,
-                                            sep_token_extra=bool(model_type in ['roberta']),
-                                            # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
-                                            pad_on_left=bool(model_type in ['xlnet']),  # pad on the left for xlnet
-                                            pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
-                                            pad_token_segment_id=4 if model_type in ['xlnet'] else 0,)
+def load_data(examples, label_list, tokenizer, max_seq_length, batch_size, data_type: DataType, model_type,
+              cache_dir=None):
+    layout = dict(cls_token_at_end=bool(model_type in ['xlnet']),
+                  # xlnet has a cls token at the end
+                  cls_token=tokenizer.cls_token,
+                  cls_token_segment_id=2 if model_type in ['xlnet'] else 0,
+                  sep_token=tokenizer.sep_token,
+                  sep_token_extra=bool(model_type in ['roberta']),
+                  # roberta uses an extra separator b/w pairs of sentences, cf. github.com/pytorch/fairseq/commit/1684e166e3da03f5b600dbb7855cb98ddfcd0805
+                  pad_on_left=bool(model_type in ['xlnet']),  # pad on the left for xlnet
+                  pad_token=tokenizer.convert_tokens_to_ids([tokenizer.pad_token])[0],
+                  pad_token_segment_id=4 if model_type in ['xlnet'] else 0,)
+
+    def convert():
+        logging.info("***** Convert Data to Features (Word-Piece Tokenizing) [{}] *****".format(data_type))
+        features = convert_examples_to_features(examples,
+                                                label_list,
+                                                max_seq_length,
+                                                tokenizer,
+                                                output_mode="classification",
+                                                **layout)
+        return {'input_ids': np.array([f.input_ids for f in features], dtype=np.int32),
+                'input_mask': np.array([f.input_mask for f in features], dtype=np.int8),
+                'segment_ids': np.array([f.segment_ids for f in features], dtype=np.int8),
+                'label_ids': np.array([f.label_id for f in features], dtype=np.int32)}
+
+    # Features only depend on the tokenizer, the layout and the examples, so
+    # they are shared by every run and model with an identical tokenizer
+    if cache_dir is not None:
+        cache = TokenizationCache(cache_dir, tokenizer, max_seq_length)
+        settings = json.dumps({'layout': layout, 'labels': list(label_list)}, sort_keys=True)
+        key = '{}_{}'.format(corpus_key([settings]),
+                             corpus_key([e.text_a for e in examples], [e.text_b for e in examples],
+                                        [e.label for e in examples]))
+        features = cache.corpus(key, convert)
+    else:
+        features = convert()
 
     logging.info("***** Build PyTorch DataLoader with extracted features [{}] *****".format(data_type))
     logging.info("  Num examples = %d", len(examples))
     logging.info("  Batch size = %d", batch_size)
     logging.info("  Max Sequence Length = %d", max_seq_length)
-    all_input_ids = torch.tensor([f.input_ids for f in features], dtype=torch.long)
-    all_input_mask = torch.tensor([f.input_mask for f in features], dtype=torch.long)
-    all_segment_ids = torch.tensor([f.segment_ids for f in features], dtype=torch.long)
-    all_label_ids = torch.tensor([f.label_id for f in features], dtype=torch.long)
+    all_input_ids = torch.from_numpy(features['input_ids']).long()
+    all_input_mask = torch.from_numpy(features['input_mask']).long()
+    all_segment_ids = torch.from_numpy(features['segment_ids']).long()
+    all_label_ids = torch.from_numpy(features['label_ids']).long()
     data = TensorDataset(all_input_ids, all_input_mask, all_segment_ids, all_label_ids)
 
     if data_type == DataType.TRAINING:
@@ -303,6 +324,35 @@ def predict(model, device, test_data_loader, include_token_type_ids=False):
 
     return simple_accuracy, f1, report, scores, pd.DataFrame({'predictions': predicted_class, 'labels': labels})
     
+def pair_token_lengths(examples, tokenizer, model_type, sample=2000, seed=0):
+    """
+    Returns the untruncated token counts of a sample of examples, special
+    tokens included, as laid out by convert_examples_to_features.
+    """
+    sep_token_extra = model_type in ['roberta']
+    lengths = []
+    for i in sample_rows(len(examples), sample, seed):
+        example = examples[i]
+        length = len(tokenizer.tokenize(example.text_a))
+        if example.text_b:
+            length += len(tokenizer.tokenize(example.text_b)) + (4 if sep_token_extra else 3)
+        else:
+            length += 3 if sep_token_extra else 2
+        lengths.append(length)
+    return np.array(lengths, dtype=np.int64)
+
+
+def adaptive_max_length(examples, tokenizer, model_type, percentile, upper=512):
+    """
+    Returns the smallest max_seq_length that covers `percentile` of the
+    token lengths of `examples`, along with their length profile.
+    """
+    lengths = pair_token_lengths(examples, tokenizer, model_type)
+    max_length = choose_max_length(lengths, percentile, upper=upper)
+    logging.info("Max sequence length {} covers {}% of sampled pairs".format(max_length, percentile))
+    return max_length, dict(length_profile(lengths, max_length), percentile=percentile)
+
+
 def _truncate_seq_pair(id, tokens_a, tokens_b, max_length):
     """Truncates a sequence pair in place to the maximum length."""
 
@@ -554,6 +604,8 @@ def read_arguments_train():
     parser.add_argument('--log_dir', default=None, type=str, required=True)
     parser.add_argument('--data_name', default=None, type=str, required=True)
     parser.add_argument('--max_seq_length', default=128, type=int)
+    # Overrides --max_seq_length and the per dataset test lengths when given
+    parser.add_argument('--max_length_percentile', default=None, type=float)
     #parser.add_argument('--data_processor', default=None, type=str, required=True)
     parser.add_argument('--model_name_or_path', default="pre_trained_model/bert-base-uncased", type=str, required=True)
     parser.add_argument('--model_type', default='bert', type=str)
@@ -569,10 +621,13 @@ def read_arguments_train():
     parser.add_argument('--weight_decay', default=0.0, type=float)
 
     parser.add_argument('--seed', default=42, type=int)
+    parser.add_argument('--tokenization_cache_dir', default=None, type=str)
 
     args = parser.parse_args()
 
     args.model_output_dir = args.exp_dir
+    if args.tokenization_cache_dir is None:
+        args.tokenization_cache_dir = os.path.join(args.exp_dir, 'tokenization_cache')
 
     logging.info("*** parsed configuration from command line and combine with constants ***")
 
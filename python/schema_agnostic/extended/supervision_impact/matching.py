@@ -12,6 +12,7 @@ from scipy import spatial, stats
 import json
 import sys
 import os
+from embedding_store import load_embeddings
 
         
 if __name__ == '__main__':     
@@ -44,10 +45,12 @@ if __name__ == '__main__':
                 valid = pd.read_csv(current_dir + '/valid.csv', na_filter=False)
                 test = pd.read_csv(current_dir + '/test.csv', na_filter=False)
                 
-                file1 = '{}{}/tableA_aggregate_{}.csv'.format(emb_dir, dataset, vectorizer)
-                file2 = '{}{}/tableB_aggregate_{}.csv'.format(emb_dir, dataset, vectorizer)
-                df1 = pd.read_csv(file1, header=None, index_col=0)
-                df2 = pd.read_csv(file2, header=None, index_col=0)
+                file1 = '{}{}/tableA_aggregate_{}'.format(emb_dir, dataset, vectorizer)
+                file2 = '{}{}/tableB_aggregate_{}'.format(emb_dir, dataset, vectorizer)
+                ids1, vectors1 = load_embeddings(file1)
+                df1 = pd.DataFrame(vectors1, index=ids1)
+                ids2, vectors2 = load_embeddings(file2)
+                df2 = pd.DataFrame(vectors2, index=ids2)
                 
                 
                 time_1 = time.time()
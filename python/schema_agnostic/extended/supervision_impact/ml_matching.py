@@ -8,6 +8,7 @@ import os
 from sklearn.svm import SVC
 from sklearn.model_selection import GridSearchCV, StratifiedKFold
 from sklearn.metrics import f1_score, precision_score, recall_score, accuracy_score
+from embedding_store import load_embeddings
 
 
 def balance_classes(df):
@@ -53,10 +54,12 @@ if __name__ == '__main__':
                         valid = balance_classes(valid)
                     test = pd.read_csv(current_dir + '/test.csv', na_filter=False)
                     
-                    file1 = '{}{}/tableA_aggregate_{}.csv'.format(emb_dir, dataset, vectorizer)
-                    file2 = '{}{}/tableB_aggregate_{}.csv'.format(emb_dir, dataset, vectorizer)
-                    df1 = pd.read_csv(file1, header=None, index_col=0)
-                    df2 = pd.read_csv(file2, header=None, index_col=0)
+                    file1 = '{}{}/tableA_aggregate_{}'.format(emb_dir, dataset, vectorizer)
+                    file2 = '{}{}/tableB_aggregate_{}'.format(emb_dir, dataset, vectorizer)
+                    ids1, vectors1 = load_embeddings(file1)
+                    df1 = pd.DataFrame(vectors1, index=ids1)
+                    ids2, vectors2 = load_embeddings(file2)
+                    df2 = pd.DataFrame(vectors2, index=ids2)
                     
                     
                     preprocessing_time = time.time()
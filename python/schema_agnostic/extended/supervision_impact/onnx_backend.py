@@ -0,0 +1,134 @@
+import os
+import json
+from types import SimpleNamespace
+import numpy as np
+import torch
+import onnxruntime as ort
+
+
+class SentenceEmbedding(torch.nn.Module):
+    """Exposes a SentenceTransformer, pooling head included, as a tensor function."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        features = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        return self.model(features)['sentence_embedding']
+
+
+class LastHiddenState(torch.nn.Module):
+    """
+    Exposes a HF encoder as a tensor function returning last_hidden_state,
+    taking the `input_names` of its tokenizer in order, e.g. the
+    token_type_ids that XLNet turns into segment encodings.
+    """
+
+    def __init__(self, model, input_names=('input_ids', 'attention_mask')):
+        super().__init__()
+        self.model = model
+        self.input_names = list(input_names)
+
+    def forward(self, *inputs):
+        return self.model(**dict(zip(self.input_names, inputs)),
+                          return_dict=True).last_hidden_state
+
+
+def export(module, path, output_name, output_axes, input_names=('input_ids', 'attention_mask'),
+           check_inputs=None, atol=1e-3, opset_version=13):
+    """
+    Exports `module` to `path` with `input_names` as inputs with dynamic
+    batch and sequence axes; the dynamic axes of the output are given by
+    `output_axes`. The input names are recorded in `path`.json, see
+    exported_inputs. With `check_inputs`, a dict of tensors such as a
+    tokenized batch, the exported graph must reproduce the output of
+    `module` on them within `atol`, or it is discarded.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    module = module.cpu().eval()
+    input_names = list(input_names)
+    # Segment ids are kept at 0, valid for every model
+    inputs = tuple(torch.zeros((2, 8), dtype=torch.long) if name == 'token_type_ids'
+                   else torch.ones((2, 8), dtype=torch.long) for name in input_names)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes[output_name] = output_axes
+    with torch.no_grad():
+        torch.onnx.export(module, inputs, path + '.tmp',
+                          input_names=input_names,
+                          output_names=[output_name], dynamic_axes=dynamic_axes,
+                          opset_version=opset_version)
+    if check_inputs is not None:
+        with torch.no_grad():
+            expected = module(*(check_inputs[name] for name in input_names)).numpy()
+        session = create_session(path + '.tmp')
+        actual = session.run(None, {name: check_inputs[name].numpy().astype(np.int64)
+                                    for name in input_names})[0]
+        difference = float(np.abs(actual - expected).max())
+        if difference > atol:
+            os.remove(path + '.tmp')
+            raise ValueError(f'The ONNX export of {path} differs from torch by {difference}')
+    os.replace(path + '.tmp', path)
+    with open(path + '.json', 'w') as f:
+        f.write(json.dumps({'input_names': input_names}))
+
+
+def exported_inputs(path):
+    """
+    Returns the input names the graph at `path` was exported with, or None
+    if it was not, or was before they were recorded.
+    """
+    if not os.path.exists(path) or not os.path.exists(path + '.json'):
+        return None
+    with open(path + '.json') as f:
+        return json.loads(f.read())['input_names']
+
+
+def create_session(path, device='cpu', threads=None):
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads is not None:
+        options.intra_op_num_threads = threads
+    providers = ['CPUExecutionProvider']
+    if device == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+        providers = ['CUDAExecutionProvider'] + providers
+    return ort.InferenceSession(path, options, providers=providers)
+
+
+class OnnxEncoder:
+    """
+    Runs an exported HF encoder. Called like the torch model, so the same
+    tokenization and batching code drives both backends; every input of
+    the graph is taken from the tokenized batch.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        # Inputs the model ignores may have been left out of the graph
+        self.input_names = [node.name for node in session.get_inputs()]
+
+    def __call__(self, **encoded_input):
+        inputs = {name: encoded_input[name].cpu().numpy().astype(np.int64)
+                  for name in self.input_names}
+        last_hidden_state = self.session.run(None, inputs)[0]
+        return SimpleNamespace(last_hidden_state=torch.from_numpy(last_hidden_state))
+
+
+class OnnxSentenceTransformer:
+    """
+    Runs an exported SentenceTransformer; tokenization is still done by the
+    original model, which exposes encode() like a SentenceTransformer.
+    """
+
+    def __init__(self, session, model):
+        self.session = session
+        self.model = model
+
+    def encode(self, text, batch_size=32):
+        vectors = []
+        for i in range(0, len(text), batch_size):
+            features = self.model.tokenize(text[i:i+batch_size])
+            inputs = {'input_ids': features['input_ids'].numpy().astype(np.int64),
+                      'attention_mask': features['attention_mask'].numpy().astype(np.int64)}
+            vectors.append(self.session.run(None, inputs)[0])
+        return np.concatenate(vectors)
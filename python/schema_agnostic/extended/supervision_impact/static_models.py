@@ -0,0 +1,127 @@
+import os
+import json
+import shutil
+import numpy as np
+from gensim.models import KeyedVectors
+from gensim.models.fasttext import load_facebook_vectors, ft_ngram_hashes
+
+
+def kv_path(static_dir, name):
+    """Returns the path of the converted KeyedVectors of model `name`."""
+    return os.path.join(static_dir, 'kv', name, name + '.kv')
+
+
+def convert(path, save):
+    """
+    Writes converted vectors at `path` by calling `save(tmp_path)`, which
+    saves every large array in its own .npy file so that it can be
+    memory-mapped. The files are written into a temporary directory that is
+    renamed when complete.
+    """
+    directory = os.path.dirname(path)
+    tmp = directory + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    save(os.path.join(tmp, os.path.basename(path)))
+    os.replace(tmp, directory)
+
+
+def load_vectors(path, load):
+    """
+    Opens the KeyedVectors at `path` read-only memory-mapped, converting
+    them once with `load()` if needed. Processes that open the same files
+    share one copy of the vectors in the page cache.
+    """
+    if not os.path.exists(path):
+        convert(path, lambda tmp_path: load().save(tmp_path))
+    return KeyedVectors.load(path, mmap='r')
+
+
+class NgramVectors:
+    """
+    fastText vectors that open fully memory-mapped: the composed vectors of
+    the vocabulary as plain KeyedVectors, and the n-gram buckets from which
+    the vector of an out-of-vocabulary word is averaged, as
+    FastTextKeyedVectors.get_vector does. gensim does not save the composed
+    vectors of FastTextKeyedVectors and rebuilds them, in Python, on every
+    load.
+    """
+
+    def __init__(self, words, vectors_ngrams, min_n, max_n):
+        self.words = words
+        self.vectors_ngrams = vectors_ngrams
+        self.min_n = min_n
+        self.max_n = max_n
+        self.vector_size = words.vector_size
+
+    @property
+    def vectors(self):
+        return self.words.vectors
+
+    @property
+    def key_to_index(self):
+        return self.words.key_to_index
+
+    @staticmethod
+    def ngrams_path(path):
+        return path[:-len('.kv')] + '.ngrams'
+
+    @classmethod
+    def save_from(cls, vectors, path):
+        """Saves FastTextKeyedVectors `vectors` in the layout opened by load()."""
+        words = KeyedVectors(vectors.vector_size)
+        words.add_vectors(vectors.index_to_key, vectors.vectors)
+        words.save(path, separately=['vectors'])
+        np.save(cls.ngrams_path(path) + '.npy', vectors.vectors_ngrams)
+        with open(cls.ngrams_path(path) + '.json', 'w') as f:
+            f.write(json.dumps({'min_n': vectors.min_n, 'max_n': vectors.max_n}))
+
+    @classmethod
+    def load(cls, path):
+        with open(cls.ngrams_path(path) + '.json') as f:
+            settings = json.loads(f.read())
+        return cls(KeyedVectors.load(path, mmap='r'),
+                   np.load(cls.ngrams_path(path) + '.npy', mmap_mode='r'), **settings)
+
+    def get_vector(self, word):
+        if word in self.words.key_to_index:
+            return self.words.get_vector(word)
+        hashes = ft_ngram_hashes(word, self.min_n, self.max_n, len(self.vectors_ngrams))
+        if len(hashes) == 0:
+            return np.zeros(self.vector_size, dtype=np.float32)
+        return self.vectors_ngrams[hashes].sum(axis=0) / len(hashes)
+
+    def __getitem__(self, words):
+        if isinstance(words, str):
+            return self.get_vector(words)
+        return np.vstack([self.get_vector(word) for word in words])
+
+
+def load_fasttext(static_dir, bin_path=None):
+    """Returns the NgramVectors of the wiki.en fastText model."""
+    if bin_path is None:
+        bin_path = os.path.join(static_dir, 'fasttext', 'wiki.en.bin')
+    # Stored apart from the FastTextKeyedVectors of earlier conversions
+    path = kv_path(static_dir, 'wiki.en-ngrams')
+    if not os.path.exists(path):
+        convert(path, lambda tmp_path: NgramVectors.save_from(load_facebook_vectors(bin_path),
+                                                              tmp_path))
+    return NgramVectors.load(path)
+
+
+def load_word2vec(static_dir):
+    """Returns the KeyedVectors of word2vec-google-news-300."""
+    def load():
+        import gensim.downloader as api
+        return api.load('word2vec-google-news-300')
+    return load_vectors(kv_path(static_dir, 'word2vec-google-news-300'), load)
+
+
+class WordVectors:
+    """Exposes KeyedVectors through the get_word_vector() of the fasttext library."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def get_word_vector(self, word):
+        return self.vectors[word]
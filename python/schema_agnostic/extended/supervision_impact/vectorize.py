@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 import os
 import pandas as pd
-from vectorization import create_embeddings
+from vectorization import create_embeddings, registry_stats, configure_registry
 from itertools import product
 import sys
 
@@ -13,6 +13,21 @@ input_dir = sys.argv[1]
 output_dir = sys.argv[2]
 log_file = sys.argv[3] + 'supervision_vectorization.txt'
 static_dir = sys.argv[4]
+device = 'cpu' if '--cpu' in sys.argv else None
+int8 = '--int8' in sys.argv
+backend = 'onnx' if '--onnx' in sys.argv else 'torch'
+resume = '--restart' not in sys.argv
+autotune = '--autotune' in sys.argv
+memory_cap = float(sys.argv[sys.argv.index('--memory-cap')+1]) * 1024**3 if '--memory-cap' in sys.argv else None
+# Models kept warm across files and their memory budget (GB), see registry_settings
+max_models = int(sys.argv[sys.argv.index('--max-models')+1]) if '--max-models' in sys.argv else None
+model_memory = float(sys.argv[sys.argv.index('--model-memory')+1]) * 1024**3 if '--model-memory' in sys.argv else None
+configure_registry(max_models, model_memory)
+profile = '--profile' in sys.argv or '--trace-batch' in sys.argv
+trace_batch = int(sys.argv[sys.argv.index('--trace-batch')+1]) if '--trace-batch' in sys.argv else None
+timing = '--timing' in sys.argv
+max_length_percentile = float(sys.argv[sys.argv.index('--max-length-percentile')+1]) if '--max-length-percentile' in sys.argv else None
+storage = sys.argv[sys.argv.index('--storage')+1].split(',') if '--storage' in sys.argv else []
 
 if __name__ == '__main__':
     
@@ -22,6 +37,9 @@ if __name__ == '__main__':
     
     # print(files)
 
+    # Collect every table first, so that each vectorizer is loaded once
+    # and stays warm in the model registry across all datasets
+    texts = []
     for dir, file in product(dirs, files):
     
         path = '{}{}/{}'.format(input_dir, dir, file)
@@ -34,15 +52,17 @@ if __name__ == '__main__':
         
         df = df.fillna('')
         data = df.apply(lambda x: ' '.join([str(col) for col in x]), axis=1)
+        texts.append((dir, file, path, data))
         
-        text = data.tolist()
-        #text2 = data.str.split(' ').to_list()
-        
-        for vectorizer in vectorizers:
-            print(vectorizer)
+    for vectorizer in vectorizers:
+        for dir, file, path, data in texts:
+            print(vectorizer, dir, file)
+            
+            text = data.tolist()
+            #text2 = data.str.split(' ').to_list()
 
             path2 = path.replace(input_dir, output_dir)
-            path2 = path2.replace('.csv', f'_aggregate_{vectorizer}.csv')
+            path2 = path2.replace('.csv', f'_aggregate_{vectorizer}')
 
             os.makedirs(os.path.dirname(path2), exist_ok=True)
             os.makedirs(os.path.dirname(log_file), exist_ok=True)
@@ -55,6 +75,17 @@ if __name__ == '__main__':
                               'stats': data.apply(len).describe().to_dict()}
             
             embeddings = create_embeddings(text, vectorizer, log, log_file,
-                                           path2, df.index, static_dir)
+                                           path2, data.index, static_dir,
+                                           device=device, int8=int8, backend=backend,
+                                           resume=resume,
+                                           autotune=autotune, memory_cap=memory_cap,
+                                           profile=profile, trace_batch=trace_batch,
+                                           timing=timing,
+                                           max_length_percentile=max_length_percentile,
+                                           storage=storage)
             print()
         # break
+        
+        stats = registry_stats(vectorizer)
+        print('{}: loaded {} time(s), saved {:.1f}s of init time'.format(
+            vectorizer, stats['loads'], stats['saved_time']))
@@ -0,0 +1,117 @@
+import os
+import json
+import resource
+import threading
+from time import time
+import numpy as np
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak rather than current RSS, where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """
+    Samples the RSS of this process every `interval` seconds in a
+    background thread while in use as a context manager, and keeps the peak.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        self.peak = max(self.peak, current_rss())
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+
+def tune_batch_size(encode, sample, candidates, memory_cap=None):
+    """
+    Encodes `sample` with `encode(texts, b)` for every batch size in
+    `candidates`, in ascending order, after a warm-up run, and returns the
+    fastest b whose peak RSS stays within `memory_cap` bytes, along with the
+    measurements. Probing stops at the first batch size that exceeds the cap
+    or runs out of memory; if none fits, the smallest one is returned.
+    """
+    encode(sample[:min(candidates)], min(candidates))
+
+    probes = []
+    for b in sorted(candidates):
+        probe = {'b': b}
+        try:
+            with RssSampler() as sampler:
+                t1 = time()
+                encode(sample, b)
+                elapsed = time() - t1
+        except (RuntimeError, MemoryError) as e:
+            if 'out of memory' not in str(e) and not isinstance(e, MemoryError):
+                raise
+            probe['error'] = 'out of memory'
+            probes.append(probe)
+            break
+        probe['sentences_per_sec'] = len(sample) / elapsed if elapsed > 0 else None
+        probe['peak_rss'] = sampler.peak
+        probes.append(probe)
+        if memory_cap is not None and sampler.peak > memory_cap:
+            break
+
+    fitting = [probe for probe in probes if 'error' not in probe and
+               (memory_cap is None or probe['peak_rss'] <= memory_cap)]
+    if not fitting:
+        return min(candidates), probes
+    best = max(fitting, key=lambda probe: probe['sentences_per_sec'] or 0)
+    return best['b'], probes
+
+
+def sample_texts(text, size, seed=0):
+    """Returns `size` texts drawn without replacement from `text`."""
+    if len(text) <= size:
+        return list(text)
+    rows = np.random.default_rng(seed).choice(len(text), size, replace=False)
+    return [text[i] for i in np.sort(rows)]
+
+
+class TuningCache:
+    """JSON file of the batch sizes chosen so far, keyed by setting."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.loads(f.read())
+
+    def get(self, key):
+        return self.load().get(key)
+
+    def put(self, key, value):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        choices = self.load()
+        choices[key] = value
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(json.dumps(choices, indent=1))
+        os.replace(self.path + '.tmp', self.path)
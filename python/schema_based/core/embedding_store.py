@@ -0,0 +1,382 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from quantization import fit_int8, encode_int8, QuantizedVectors
+
+
+def store_files(path):
+    """
+    Returns the (header, data, ids) files of the store at `path`. A trailing
+    '.csv' is ignored, so old output paths map onto the same store.
+    """
+    if path.endswith('.csv'):
+        path = path[:-4]
+    return path + '.json', path + '.bin', path + '.ids.npy'
+
+
+def checkpoint_file(path):
+    return store_files(path)[0][:-len('.json')] + '.ckpt.json'
+
+
+class EmbeddingWriter:
+    """
+    Writes embeddings chunk by chunk into a raw row-major buffer. The ids and
+    the JSON header are written on close, so a store without a header is an
+    incomplete one and is never opened by load_embeddings.
+
+    With a `config`, every chunk written is checkpointed with its end row and
+    the key of its input, and the store or checkpoint left by an earlier run
+    with the same config is picked up: `resume` skips the chunks whose key
+    still matches, and the store is cut back at the first one that does not.
+
+    `columns` names the columns of a store whose rows hold the vectors of
+    several text columns side by side (see ColumnWriter).
+
+    The header records a digest of the content: of the config and the keys
+    of the chunks, which identify their input, or of the vectors and ids of
+    chunks written without a key. Artifacts derived from a store are keyed
+    by it (see store_digest).
+    """
+
+    def __init__(self, path, dtype='float32', config=None, columns=None):
+        self.header_file, self.data_file, self.ids_file = store_files(path)
+        self.checkpoint_file = checkpoint_file(path)
+        self.dtype = np.dtype(dtype)
+        self.config = config
+        self.columns = columns
+        self.rows = 0
+        self.dimensions = None
+        self.ids = []
+        self.chunks = []
+        self.previous = []
+        self.digest = hashlib.blake2b(json.dumps([config, self.dtype.name]).encode('utf-8'),
+                                      digest_size=16)
+
+        if config is not None:
+            self.previous, self.dimensions = self.load_checkpoint()
+        if not self.previous:
+            self.dimensions = None
+            self.remove_header()
+        # Otherwise the header stays until the first write: once the
+        # checkpoint is gone, it is the only record a later run can resume from
+        self.f = open(self.data_file, 'r+b' if self.previous else 'wb')
+        self.truncated = False
+
+    def remove_header(self):
+        if os.path.exists(self.header_file):
+            os.remove(self.header_file)
+
+    def row_bytes(self):
+        return (self.dimensions or 0) * self.dtype.itemsize
+
+    def load_checkpoint(self):
+        """
+        Returns the (end row, key) chunks and the dimensions of an earlier
+        run with the same config, keeping only the chunks on disk.
+        """
+        if not os.path.exists(self.data_file):
+            return [], None
+        for file in [self.checkpoint_file, self.header_file]:
+            if not os.path.exists(file):
+                continue
+            with open(file) as f:
+                checkpoint = json.loads(f.read())
+            if checkpoint.get('config') != self.config or \
+                    checkpoint.get('dtype') != self.dtype.name:
+                continue
+            self.dimensions = checkpoint['dimensions']
+            size = os.path.getsize(self.data_file)
+            chunks = [chunk for chunk in checkpoint.get('chunks', [])
+                      if chunk[0] * self.row_bytes() <= size]
+            return chunks, checkpoint['dimensions']
+        return [], None
+
+    def save_checkpoint(self):
+        checkpoint = {'rows': self.rows, 'dimensions': self.dimensions,
+                      'dtype': self.dtype.name, 'config': self.config,
+                      'chunks': self.chunks}
+        with open(self.checkpoint_file + '.tmp', 'w') as f:
+            f.write(json.dumps(checkpoint))
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+
+    def matches(self, index, key):
+        """Returns True if the next chunk of the earlier run has ids `index` and input `key`."""
+        n = len(self.chunks)
+        return n < len(self.previous) and self.previous[n][1] == key and \
+            self.previous[n][0] == self.rows + len(index)
+
+    def resume(self, index, key):
+        """
+        Returns True if the next chunk, with ids `index` and input `key`, was
+        already written by an earlier run and records its ids. Otherwise the
+        rest of the earlier run is dropped and False is returned.
+        """
+        n = len(self.chunks)
+        if self.matches(index, key):
+            self.digest.update(f'{key}\x1e'.encode('utf-8'))
+            self.ids.append(np.asarray(index))
+            self.rows += len(index)
+            self.chunks.append(self.previous[n])
+            return True
+        self.previous = []
+        if self.rows == 0:
+            # Nothing of the earlier run is kept, so neither is its shape
+            self.dimensions = None
+        return False
+
+    def write(self, vectors, index, key=None):
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if not self.truncated:
+            # Anything past the resumed chunks belongs to the earlier run
+            self.previous = []
+            self.remove_header()
+            if self.rows == 0:
+                self.dimensions = None
+            self.f.seek(self.rows * self.row_bytes())
+            self.f.truncate()
+            self.truncated = True
+
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(f'Expected {self.dimensions} dimensions, got {vectors.shape[1]}')
+        if len(index) != vectors.shape[0]:
+            raise ValueError(f'Got {len(index)} ids for {vectors.shape[0]} vectors')
+
+        self.f.write(vectors.tobytes())
+        self.ids.append(np.asarray(index))
+        if key is not None:
+            self.digest.update(f'{key}\x1e'.encode('utf-8'))
+        else:
+            self.digest.update(vectors.tobytes())
+            self.digest.update('\x1f'.join(str(i) for i in index).encode('utf-8') + b'\x1e')
+        self.rows += vectors.shape[0]
+
+        if self.config is not None:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.chunks.append([self.rows, key])
+            self.save_checkpoint()
+
+    def close(self):
+        expected = self.rows * self.row_bytes()
+        # Writers without a config only flush here
+        self.f.flush()
+        if os.fstat(self.f.fileno()).st_size < expected:
+            self.f.close()
+            raise ValueError(f'{self.data_file} is shorter than its {self.rows} rows')
+        self.f.truncate(expected)
+        self.f.close()
+
+        ids = np.concatenate(self.ids) if self.ids else np.empty(0, dtype=np.int64)
+        if len(ids) != self.rows:
+            raise ValueError(f'Got {len(ids)} ids for {self.rows} rows')
+        if ids.dtype == object:
+            ids = ids.astype(str)
+        np.save(self.ids_file, ids, allow_pickle=False)
+
+        header = {'rows': self.rows,
+                  'dimensions': self.dimensions if self.dimensions is not None else 0,
+                  'dtype': self.dtype.name,
+                  'data': os.path.basename(self.data_file),
+                  'ids': os.path.basename(self.ids_file),
+                  'digest': self.digest.hexdigest()}
+        if self.config is not None:
+            header['config'] = self.config
+            header['chunks'] = self.chunks
+        if self.columns is not None:
+            header['columns'] = self.columns
+        with open(self.header_file, 'w') as f:
+            f.write(json.dumps(header))
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+
+
+class ColumnWriter:
+    """
+    Writes the vectors of several text columns of one table, encoded together,
+    chunk by chunk. A chunk holds the vectors of rows `index` for every
+    column in turn. With a list of `paths`, every column gets its own store;
+    with a single path, the columns are written side by side into one store
+    that records their names and is read per column by load_embeddings.
+    """
+
+    def __init__(self, paths, columns, dtype='float32', config=None):
+        self.columns = list(columns)
+        self.combined = isinstance(paths, str)
+        if self.combined:
+            self.writers = [EmbeddingWriter(paths, dtype, config, self.columns)]
+        else:
+            if len(paths) != len(self.columns):
+                raise ValueError(f'Got {len(paths)} paths for {len(self.columns)} columns')
+            self.writers = [EmbeddingWriter(path, dtype, config) for path in paths]
+
+    @property
+    def rows(self):
+        return self.writers[0].rows
+
+    @property
+    def dimensions(self):
+        dimensions = self.writers[0].dimensions
+        if self.combined and dimensions is not None:
+            return dimensions // len(self.columns)
+        return dimensions
+
+    def resume(self, index, key):
+        """
+        Like EmbeddingWriter.resume, for all the stores at once: a chunk is
+        skipped only if every store has it, as a run may have been stopped
+        between the writes of the same chunk to two stores.
+        """
+        if all(writer.matches(index, key) for writer in self.writers):
+            for writer in self.writers:
+                writer.resume(index, key)
+            return True
+        for writer in self.writers:
+            writer.previous = []
+            if writer.rows == 0:
+                writer.dimensions = None
+        return False
+
+    def write(self, vectors, index, key=None):
+        if len(vectors) != len(self.columns) * len(index):
+            raise ValueError(f'Got {len(vectors)} vectors for {len(index)} rows '
+                             f'of {len(self.columns)} columns')
+        parts = np.split(np.asarray(vectors), len(self.columns))
+        if self.combined:
+            self.writers[0].write(np.hstack(parts), index, key)
+        else:
+            for writer, part in zip(self.writers, parts):
+                writer.write(part, index, key)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for writer in self.writers:
+                writer.f.close()
+
+
+def load_header(path):
+    header_file, _, _ = store_files(path)
+    with open(header_file) as f:
+        return json.loads(f.read())
+
+
+def store_digest(path):
+    """
+    Returns the content digest of the store at `path`, which changes whenever
+    its vectors or ids do. Stores written before it was recorded fall back
+    to a hash of their header.
+    """
+    with open(store_files(path)[0], 'rb') as f:
+        header = f.read()
+    return json.loads(header).get('digest') or hashlib.blake2b(header, digest_size=16).hexdigest()
+
+
+def storage_path(path, storage):
+    """Returns the path of the `storage` copy of the float32 store at `path`."""
+    if storage == 'float32':
+        return path
+    if path.endswith('.csv'):
+        path = path[:-4]
+    return f'{path}.{storage}'
+
+
+def convert_store(path, storage, chunk_size=100000):
+    """
+    Writes a float16 or int8 copy of the float32 store at `path`, unless an
+    up-to-date one exists, and returns its path. int8 stores hold 8-bit codes
+    with a per-dimension offset (vmin) and range (vdiff) kept in the header.
+    """
+    if storage == 'float32':
+        return path
+    target = storage_path(path, storage)
+    source = store_digest(path)
+    if os.path.exists(store_files(target)[0]) and load_header(target).get('source') == source:
+        return target
+
+    ids, vectors = load_embeddings(path)
+    header = load_header(path)
+    if storage == 'int8':
+        vmin, vdiff = fit_int8(vectors, chunk_size)
+        header['quantization'] = {'vmin': vmin.tolist(), 'vdiff': vdiff.tolist()}
+        dtype = 'uint8'
+    else:
+        dtype = storage
+    o = EmbeddingWriter(target, dtype)
+    for i in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[i:i+chunk_size], dtype=np.float32)
+        if storage == 'int8':
+            chunk = encode_int8(chunk, vmin, vdiff)
+        o.write(chunk, ids[i:i+chunk_size])
+    if len(vectors) == 0:
+        o.dimensions = vectors.shape[1]
+    o.close()
+
+    # The header is completed once the data is in place
+    target_header = load_header(target)
+    for key in ['columns', 'quantization']:
+        if key in header:
+            target_header[key] = header[key]
+    target_header['storage'] = storage
+    target_header['source'] = source
+    with open(store_files(target)[0] + '.tmp', 'w') as f:
+        f.write(json.dumps(target_header))
+    os.replace(store_files(target)[0] + '.tmp', store_files(target)[0])
+    return target
+
+
+def load_embeddings(path, column=None, storage='float32'):
+    """
+    Opens the store at `path` and returns (ids, vectors), where vectors is a
+    read-only memmap. Embeddings written by older runs as CSV are still read,
+    but are parsed into memory. For a store of several columns, `column`
+    selects the vectors of one of them.
+
+    With `storage` 'float16' or 'int8', the copy written by convert_store is
+    opened instead; int8 vectors are returned as QuantizedVectors, which
+    dequantize rows as they are read.
+    """
+    path = storage_path(path, storage)
+    header_file, data_file, ids_file = store_files(path)
+    if not os.path.exists(header_file):
+        csv_file = header_file[:-len('.json')] + '.csv'
+        df = pd.read_csv(csv_file, header=None, index_col=0)
+        return df.index.values, df.values.astype(np.float32)
+
+    header = load_header(path)
+    ids = np.load(ids_file, allow_pickle=False)
+    shape = (header['rows'], header['dimensions'])
+    if header['rows'] == 0:
+        return ids, np.empty(shape, dtype=header['dtype'])
+    vectors = np.memmap(data_file, dtype=header['dtype'], mode='r', shape=shape)
+    if 'quantization' in header:
+        vectors = QuantizedVectors(vectors, header['quantization']['vmin'],
+                                   header['quantization']['vdiff'])
+    if column is not None:
+        dimensions = header['dimensions'] // len(header['columns'])
+        start = header['columns'].index(column) * dimensions
+        if isinstance(vectors, QuantizedVectors):
+            vectors = vectors.columns(start, start+dimensions)
+        else:
+            vectors = vectors[:, start:start+dimensions]
+    return ids, vectors
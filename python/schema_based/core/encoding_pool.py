@@ -0,0 +1,129 @@
+import os
+import sys
+import traceback
+import multiprocessing as mp
+from time import time
+import numpy as np
+
+
+def core_groups(workers):
+    """
+    Splits the cores available to this process into `workers` groups, or
+    into one group per core when there are fewer cores than workers.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count()))
+    workers = max(1, min(workers, len(cores)))
+    return [[int(core) for core in group] for group in np.array_split(cores, workers)]
+
+
+def worker_loop(worker_no, cores, threads, config, tasks, results):
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        import torch
+        torch.set_num_threads(threads)
+        from vectorization import get_model, get_token_cache, encode_texts
+
+        t1 = time()
+        model = get_model(config['vectorizer'], config['static_dir'], 'cpu',
+                          config['int8'], config['backend'], threads)[0]
+        token_cache = None
+        if config['use_cache']:
+            token_cache = get_token_cache(config['vectorizer'], model,
+                                          config['static_dir'], config['max_length'])
+        results.put(('ready', worker_no, time() - t1))
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            shard_no, texts = task
+            t1 = time()
+            vectors = encode_texts(model, texts, config['vectorizer'], config['b'],
+                                   config['max_length'], 'cpu', token_cache=token_cache)
+            results.put((shard_no, worker_no, vectors, time() - t1))
+        if token_cache is not None:
+            token_cache.flush()
+    except Exception:
+        results.put(('error', worker_no, traceback.format_exc()))
+
+
+class EncodingPool:
+    """
+    Encodes texts on CPU with `workers` processes, each pinned to its own
+    group of cores and running `threads` intra-op threads (one per core by
+    default). Texts are sharded across the workers and the vectors are
+    returned in input order. Workers load their model on start.
+    """
+
+    def __init__(self, workers, vectorizer, static_dir, b, max_length,
+                 int8=False, backend='torch', threads=None, shard_size=1000,
+                 use_cache=True):
+        self.shard_size = shard_size
+        config = {'vectorizer': vectorizer, 'static_dir': static_dir, 'b': b,
+                  'max_length': max_length, 'int8': int8, 'backend': backend,
+                  'use_cache': use_cache}
+
+        context = mp.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = []
+        self.stats = []
+        for worker_no, cores in enumerate(core_groups(workers)):
+            worker_threads = threads if threads is not None else len(cores)
+            process = context.Process(target=worker_loop, daemon=True,
+                                      args=(worker_no, cores, worker_threads, config,
+                                            self.tasks, self.results))
+            process.start()
+            self.processes.append(process)
+            self.stats.append({'worker': worker_no, 'cores': cores,
+                               'threads': worker_threads, 'init_time': None,
+                               'rows': 0, 'busy_time': 0.0})
+
+        for _ in self.processes:
+            _, worker_no, init_time = self.receive()
+            self.stats[worker_no]['init_time'] = init_time
+
+    def receive(self):
+        message = self.results.get()
+        if message[0] == 'error':
+            self.close()
+            raise RuntimeError(f'Encoding worker {message[1]} failed:\n{message[2]}')
+        return message
+
+    def encode(self, text):
+        shards = range(0, len(text), self.shard_size)
+        for shard_no, i in enumerate(shards):
+            self.tasks.put((shard_no, text[i:i+self.shard_size]))
+
+        vectors = [None] * len(shards)
+        for received in range(len(shards)):
+            print(f'\r\t {received}/{len(shards)}', end='')
+            shard_no, worker_no, shard_vectors, busy_time = self.receive()
+            vectors[shard_no] = shard_vectors
+            self.stats[worker_no]['rows'] += len(shard_vectors)
+            self.stats[worker_no]['busy_time'] += busy_time
+        return np.concatenate(vectors)
+
+    def worker_stats(self):
+        stats = []
+        for worker in self.stats:
+            worker = dict(worker)
+            busy_time = worker['busy_time']
+            worker['sentences_per_sec'] = worker['rows'] / busy_time if busy_time > 0 else None
+            stats.append(worker)
+        return stats
+
+    def close(self):
+        for process in self.processes:
+            if process.is_alive():
+                self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
@@ -0,0 +1,42 @@
+import copy
+import numpy as np
+
+
+def resolve_device(device=None):
+    """Returns `device`, or 'cuda' when available and 'cpu' otherwise."""
+    if device is not None:
+        return device
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def set_threads(threads=None):
+    """Sets the intra-op threads used by torch on CPU; None keeps the default."""
+    import torch
+    if threads is not None:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+
+def quantize(model):
+    """
+    Returns an int8 dynamically quantized copy of a CPU model: the weights of
+    every Linear layer are stored in int8 and activations are quantized on
+    the fly. (tokenizer, model) pairs keep their tokenizer.
+    """
+    if isinstance(model, tuple):
+        tokenizer, model = model
+        return tokenizer, quantize(model)
+    import torch
+    model = copy.deepcopy(model).cpu()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def cosine_drift(reference, vectors, eps=1e-8):
+    """Row-wise cosine between two encodings of the same texts."""
+    reference = np.asarray(reference, dtype=np.float64)
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1)
+    cosines = (reference * vectors).sum(axis=1) / np.maximum(norms, eps)
+    return {'cosine_mean': float(cosines.mean()),
+            'cosine_min': float(cosines.min())}
@@ -0,0 +1,116 @@
+import numpy as np
+from quantization import QuantizedVectors, float_rows, squared_norms, squared_l2_tiles
+
+
+MEMORY_BUDGET = 256 * 1024**2
+
+
+def tile_sizes(n_queries, n_base, k, memory_budget=MEMORY_BUDGET, base_tile=16384):
+    """
+    Returns the (query_tile, base_tile) whose float32 distance block, plus the
+    running top-k it is merged into, fits in `memory_budget` bytes.
+    """
+    base_tile = max(1, min(base_tile, n_base))
+    # The block, and its concatenation with the running top-k for the merge
+    row_bytes = 4 * (2 * base_tile + 3 * k)
+    query_tile = max(1, min(n_queries, memory_budget // row_bytes))
+    return int(query_tile), int(base_tile)
+
+
+def merge_topk(best_dists, best_indices, block, offset, k):
+    """Merges a block of distances, for base rows from `offset` on, into the running top-k."""
+    dists = np.concatenate([best_dists, block], axis=1)
+    indices = np.concatenate([best_indices,
+                              np.broadcast_to(np.arange(offset, offset+block.shape[1], dtype=np.int32),
+                                              block.shape)], axis=1)
+    if dists.shape[1] > k:
+        keep = np.argpartition(dists, k-1, axis=1)[:, :k]
+        dists = np.take_along_axis(dists, keep, axis=1)
+        indices = np.take_along_axis(indices, keep, axis=1)
+    return dists, indices
+
+
+def sort_topk(dists, indices):
+    order = np.argsort(dists, axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(dists, order, axis=1)
+
+
+def exact_knn_cpu(queries, base, k, memory_budget=MEMORY_BUDGET):
+    query_tile, base_tile = tile_sizes(len(queries), len(base), k, memory_budget)
+    indices = np.empty((len(queries), k), dtype=np.int32)
+    dists = np.empty((len(queries), k), dtype=np.float32)
+    base_norms = squared_norms(base, base_tile)
+    best_dists = best_indices = None
+    for i, j, block in squared_l2_tiles(queries, base, query_tile, base_tile, base_norms):
+        if j == 0:
+            best_dists = np.empty((block.shape[0], 0), dtype=np.float32)
+            best_indices = np.empty((block.shape[0], 0), dtype=np.int32)
+        best_dists, best_indices = merge_topk(best_dists, best_indices, block, j, k)
+        if j + block.shape[1] == len(base):
+            indices[i:i+len(block)], dists[i:i+len(block)] = sort_topk(best_dists, best_indices)
+    return indices, np.sqrt(dists, out=dists)
+
+
+def base_tile_gpu(base, start, end):
+    """
+    Returns rows [start, end) of `base` on the GPU as float32. float16 rows
+    and int8 codes are copied as stored and widened on the device.
+    """
+    import torch
+    rows = base.codes[start:end] if isinstance(base, QuantizedVectors) else base[start:end]
+    return torch.from_numpy(np.array(rows)).cuda().float()
+
+
+def exact_knn_gpu(queries, base, k, memory_budget=MEMORY_BUDGET):
+    import torch
+    query_tile, base_tile = tile_sizes(len(queries), len(base), k, memory_budget)
+    quantized = isinstance(base, QuantizedVectors)
+    base_norms = torch.from_numpy(squared_norms(base, base_tile)).cuda()
+    if quantized:
+        vmin = torch.from_numpy(base.vmin).cuda()
+        scale = torch.from_numpy(base.vdiff / 255).cuda()
+    indices = np.empty((len(queries), k), dtype=np.int32)
+    dists = np.empty((len(queries), k), dtype=np.float32)
+    for i in range(0, len(queries), query_tile):
+        x = torch.from_numpy(float_rows(queries, i, i+query_tile)).cuda()
+        x_norms = (x * x).sum(dim=1, keepdim=True)
+        if quantized:
+            # The dequantization is folded into the product, as in squared_l2_tiles
+            x_scaled = x * scale
+            x_offset = (x @ vmin)[:, None]
+        best_dists = torch.empty((len(x), 0), device=x.device)
+        best_indices = torch.empty((len(x), 0), dtype=torch.int64, device=x.device)
+        # The indexed side is streamed to the GPU a tile at a time, so only
+        # one tile of it is resident
+        for j in range(0, len(base), base_tile):
+            tile = base_tile_gpu(base, j, j+base_tile)
+            if quantized:
+                tile += 0.5
+                dots = torch.addmm(x_offset, x_scaled, tile.T)
+            else:
+                dots = x @ tile.T
+            block = (x_norms + base_norms[None, j:j+len(tile)]).sub_(dots, alpha=2).clamp_(min=0)
+            tile_indices = torch.arange(j, j+len(tile), device=x.device)
+            best_dists = torch.cat([best_dists, block], dim=1)
+            best_indices = torch.cat([best_indices, tile_indices.expand(len(x), -1)], dim=1)
+            best_dists, keep = torch.topk(best_dists, min(k, best_dists.shape[1]), dim=1, largest=False)
+            best_indices = torch.gather(best_indices, 1, keep)
+        indices[i:i+len(x)] = best_indices.cpu().numpy()
+        dists[i:i+len(x)] = best_dists.cpu().numpy()
+    return indices, np.sqrt(dists, out=dists)
+
+
+def exact_knn(queries, base, k, gpu=False, memory_budget=MEMORY_BUDGET):
+    """
+    Returns the (indices, distances) of the k nearest rows of `base` to every
+    row of `queries`, as (len(queries) x k) int32 and float32 Euclidean
+    arrays sorted by distance. Both sides may be float32, float16 or quantized
+    memmaps: `base` is streamed in tiles against a tile of queries, sized to
+    `memory_budget` bytes, and merged into a running top-k, so neither the
+    full distance matrix nor, on the GPU, the whole of `base` is held.
+    """
+    k = min(k, len(base))
+    if gpu:
+        return exact_knn_gpu(queries, base, k, memory_budget)
+    return exact_knn_cpu(queries, base, k, memory_budget)
+
@@ -8,6 +8,8 @@ from time import time
 import numpy as np
 import sys
 from utils import vectorizers, cases
+from embedding_store import load_embeddings
+from candidates import CandidatePairs, evaluate
 
 
 data_dir = sys.argv[1]
@@ -30,7 +32,7 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
     ground_file = '{}{}/{}.csv'.format(data_dir, dir, ground_file)
     ground_df = pd.read_csv(ground_file, sep=sep)
     # ground_results = set(ground_df.apply(lambda x: (f'r_{x[0]}', f's_{x[1]}'), axis=1).values)
-    ground_results = set(ground_df.apply(lambda x: (x[0], x[1]), axis=1).values)
+    ground_results = CandidatePairs.from_ground_truth(ground_df)
     
     for nocol, (col1, col2) in enumerate(cols):
         if nocol == 2:
@@ -39,11 +41,11 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
             print('\t{} {}\r'.format(nocol, vec), end='')
             torch.cuda.empty_cache()
             #print()
-            file1 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data1, col1, vec)
-            file2 = '{}{}/{}_{}_{}.csv'.format(emb_dir, dir, data2, col2, vec)
+            file1 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data1, col1, vec)
+            file2 = '{}{}/{}_{}_{}'.format(emb_dir, dir, data2, col2, vec)
             
-            df1 = pd.read_csv(file1, header=None, index_col=0).values
-            df2 = pd.read_csv(file2, header=None, index_col=0).values
+            _, df1 = load_embeddings(file1)
+            _, df2 = load_embeddings(file2)
                 
             #cdists
             dist_time = time()
@@ -88,16 +90,10 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
             for noind, ind in enumerate(indices):
                 
                 while dists[ind] < delta:
-                    results2 = set(results)
+                    results2 = CandidatePairs.from_pairs(results)
                     matching_time2 = time() - matching_time
         
-                    true_positives = len(ground_results & results2)
-                    if true_positives > 0:
-                        recall =  true_positives / len(ground_results)
-                        precision =  true_positives / len(results2)
-                        f1 = 2 * (precision*recall) / (precision + recall)
-                    else:
-                        recall, precision, f1 = 0, 0, 0
+                    recall, precision, f1 = evaluate(ground_results, results2)
                    
                     scores2.append((nocase, nocol, vec, recall, precision, f1, matching_time2, len(results2), delta)) 
                     delta -= 0.05
@@ -122,19 +118,13 @@ for nocase, (data1, data2, ground_file, sep, dir, cols) in enumerate(cases):
                     break
                 
             
-            results = set(results)
+            results = CandidatePairs.from_pairs(results)
             matching_time = time() - matching_time
 
 
             #recall
             recall_time = time()
-            true_positives = len(ground_results & results)
-            if true_positives > 0:
-                recall =  true_positives / len(ground_results)
-                precision =  true_positives / len(results)
-                f1 = 2 * (precision*recall) / (precision + recall)
-            else:
-                recall, precision, f1 = 0, 0, 0
+            recall, precision, f1 = evaluate(ground_results, results)
             recall_time = time() - recall_time  
             
             del dists
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+STORAGES = ['float32', 'float16', 'int8']
+
+
+def fit_int8(vectors, chunk_size=100000):
+    """Returns the per-dimension minimum and range of `vectors`, read in chunks."""
+    vmin, vmax = None, None
+    for i in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[i:i+chunk_size], dtype=np.float32)
+        low, high = chunk.min(axis=0), chunk.max(axis=0)
+        vmin = low if vmin is None else np.minimum(vmin, low)
+        vmax = high if vmax is None else np.maximum(vmax, high)
+    vdiff = vmax - vmin
+    # Constant dimensions decode to their value whatever the code
+    vdiff[vdiff == 0] = 1.0
+    return vmin.astype(np.float32), vdiff.astype(np.float32)
+
+
+def encode_int8(vectors, vmin, vdiff):
+    """
+    Returns the 8-bit codes of `vectors`: every dimension is mapped linearly
+    from [vmin, vmin + vdiff] onto 256 levels. This is the layout of the
+    QT_8bit scalar quantizer of faiss, so its indexes can use the codes as is.
+    """
+    scaled = (np.asarray(vectors, dtype=np.float32) - vmin) / vdiff
+    return np.clip(np.floor(scaled * 255), 0, 255).astype(np.uint8)
+
+
+def decode_int8(codes, vmin, vdiff):
+    return vmin + (codes.astype(np.float32) + 0.5) * (vdiff / 255)
+
+
+class QuantizedVectors:
+    """
+    A read-only (rows x dimensions) matrix of 8-bit codes with a per-dimension
+    offset and scale. Rows are dequantized only when indexed, so callers can
+    work through it a tile at a time.
+    """
+
+    def __init__(self, codes, vmin, vdiff):
+        self.codes = codes
+        self.vmin = np.asarray(vmin, dtype=np.float32)
+        self.vdiff = np.asarray(vdiff, dtype=np.float32)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, rows):
+        return decode_int8(self.codes[rows], self.vmin, self.vdiff)
+
+    def columns(self, start, end):
+        """Returns the dimensions [start, end) of every row, still quantized."""
+        return QuantizedVectors(self.codes[:, start:end], self.vmin[start:end],
+                                self.vdiff[start:end])
+
+    def __array__(self, dtype=None):
+        vectors = self[:]
+        return vectors if dtype is None else vectors.astype(dtype)
+
+
+def float_rows(vectors, start, end):
+    """Returns rows [start, end) of a float32, float16 or quantized matrix as float32."""
+    return np.asarray(vectors[start:end], dtype=np.float32)
+
+
+def squared_norms(vectors, tile=16384):
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for i in range(0, len(vectors), tile):
+        rows = float_rows(vectors, i, i+tile)
+        norms[i:i+tile] = np.einsum('ij,ij->i', rows, rows)
+    return norms
+
+
+def squared_l2_tiles(queries, base, query_tile=1024, base_tile=16384, base_norms=None):
+    """
+    Yields (i, j, block): the squared Euclidean distances, as float32, between
+    rows [i, i+query_tile) of `queries` and rows [j, j+base_tile) of `base`,
+    two float32, float16 or quantized matrices, via |x|^2 + |y|^2 - 2 x.y.
+    The dequantization of int8 base rows is folded into the dot product,
+    x.y = x.vmin + (x * vdiff / 255).(c + 0.5), so only a tile of their codes
+    is widened at a time. A block is only valid until the next one is made.
+    """
+    if base_norms is None:
+        base_norms = squared_norms(base, base_tile)
+    quantized = isinstance(base, QuantizedVectors)
+    for i in range(0, len(queries), query_tile):
+        x = float_rows(queries, i, i+query_tile)
+        x_norms = np.einsum('ij,ij->i', x, x)
+        if quantized:
+            x_scaled = x * (base.vdiff / 255)
+            x_offset = x @ base.vmin
+        for j in range(0, len(base), base_tile):
+            if quantized:
+                codes = base.codes[j:j+base_tile].astype(np.float32)
+                codes += 0.5
+                block = x_scaled @ codes.T
+                block += x_offset[:, None]
+            else:
+                block = x @ float_rows(base, j, j+base_tile).T
+            block *= -2
+            block += x_norms[:, None]
+            block += base_norms[None, j:j+base_tile]
+            yield i, j, np.maximum(block, 0, out=block)
+
+
+def squared_l2(queries, base, query_tile=1024, base_tile=16384, base_norms=None):
+    """
+    Returns the squared Euclidean distances (len(queries) x len(base)) between
+    two float32, float16 or quantized matrices, computed by squared_l2_tiles.
+    """
+    dists = np.empty((len(queries), len(base)), dtype=np.float32)
+    for i, j, block in squared_l2_tiles(queries, base, query_tile, base_tile, base_norms):
+        dists[i:i+block.shape[0], j:j+block.shape[1]] = block
+    return dists
@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def sample_rows(n, size, seed=0):
+    """Returns `size` sorted row numbers out of `n`, or all of them if fewer."""
+    if n <= size:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, size, replace=False))
+
+
+def token_lengths(text, tokenizer, sample=2000, seed=0):
+    """
+    Returns the untruncated token counts, special tokens included, of a
+    sample of `text` tokenized by a HF tokenizer.
+    """
+    rows = sample_rows(len(text), sample, seed)
+    encoded = tokenizer([text[i] for i in rows], add_special_tokens=True)
+    return np.array([len(ids) for ids in encoded['input_ids']], dtype=np.int64)
+
+
+def choose_max_length(lengths, percentile=95, multiple=8, upper=512):
+    """
+    Returns the smallest max_length, a multiple of `multiple` and at most
+    `upper`, that truncates no more than (100 - percentile)% of `lengths`.
+    """
+    if len(lengths) == 0:
+        return multiple
+    needed = int(np.ceil(np.percentile(lengths, percentile)))
+    max_length = -(-needed // multiple) * multiple
+    return int(min(max(max_length, multiple), upper))
+
+
+def length_profile(lengths, max_length):
+    """Summarizes the token counts of a sample and how many of them `max_length` truncates."""
+    lengths = np.asarray(lengths)
+    if len(lengths) == 0:
+        return {'sample': 0}
+    return {'sample': len(lengths),
+            'percentiles': {str(p): float(np.percentile(lengths, p)) for p in [50, 90, 95, 99]},
+            'longest': int(lengths.max()),
+            'truncated': float((lengths > max_length).mean())}
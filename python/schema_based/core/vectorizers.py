@@ -0,0 +1,186 @@
+import os
+import sys
+import importlib
+from time import time
+
+
+# Seconds spent on the first import of every heavy module, see lazy_import
+import_times = {}
+
+
+def lazy_import(name):
+    """Imports module `name`, recording how long its first import took."""
+    if name in sys.modules:
+        return sys.modules[name]
+    t1 = time()
+    module = importlib.import_module(name)
+    import_times[name] = time() - t1
+    return module
+
+
+class Vectorizer:
+    """
+    A vectorizer plugin. Its metadata is known without importing or loading
+    anything; its loaders import the heavy dependencies on first use.
+    `max_length` is the token limit texts are truncated to and `b` the
+    default number of rows per encoding call.
+    """
+
+    kind = None
+
+    def __init__(self, name, revision, dimension, tokenizer_family,
+                 max_length=None, b=500):
+        self.name = name
+        self.revision = revision
+        self.dimension = dimension
+        self.tokenizer_family = tokenizer_family
+        self.max_length = max_length
+        self.b = b
+
+    def metadata(self):
+        return {'name': self.name, 'kind': self.kind, 'revision': self.revision,
+                'dimension': self.dimension, 'tokenizer_family': self.tokenizer_family,
+                'max_length': self.max_length}
+
+    def load(self, static_dir, device='cpu'):
+        raise NotImplementedError
+
+    def load_onnx(self, static_dir, device='cpu', threads=None):
+        raise ValueError(f'{self.name} has no ONNX backend')
+
+    def onnx_path(self, static_dir):
+        return static_dir + f'onnx/{self.revision}.onnx'
+
+
+class StaticVectorizer(Vectorizer):
+    """Word vectors memory-mapped by one of the loaders of static_models."""
+
+    kind = 'static'
+
+    def __init__(self, name, revision, dimension, tokenizer_family, loader):
+        super().__init__(name, revision, dimension, tokenizer_family)
+        self.loader = loader
+
+    def load(self, static_dir, device='cpu'):
+        return getattr(lazy_import('static_models'), self.loader)(static_dir)
+
+
+class TransformerVectorizer(Vectorizer):
+    """
+    A HF encoder whose [CLS] vector embeds the text. `cls_position` is where
+    its tokenizer puts that token: 'first', or 'last' for tokenizers that
+    append it and pad on the left, such as XLNet's.
+    """
+
+    kind = 'transformer'
+
+    def __init__(self, name, revision, dimension, tokenizer_family,
+                 tokenizer_class, model_class, max_length=100, b=10, cls_position='first'):
+        super().__init__(name, revision, dimension, tokenizer_family, max_length, b)
+        self.tokenizer_class = tokenizer_class
+        self.model_class = model_class
+        self.cls_position = cls_position
+
+    def transformers(self):
+        transformers = lazy_import('transformers')
+        transformers.logging.set_verbosity_error()
+        return transformers
+
+    def load_tokenizer(self):
+        tokenizer_class = getattr(self.transformers(), self.tokenizer_class)
+        return tokenizer_class.from_pretrained(self.revision)
+
+    def load(self, static_dir, device='cpu'):
+        tokenizer = self.load_tokenizer()
+        model = getattr(self.transformers(), self.model_class).from_pretrained(self.revision)
+        model.to(device)
+        return tokenizer, model
+
+    def load_onnx(self, static_dir, device='cpu', threads=None):
+        onnx_backend = lazy_import('onnx_backend')
+        path = self.onnx_path(static_dir)
+        tokenizer = self.load_tokenizer()
+        # Every model input of the tokenizer, e.g. the token_type_ids of XLNet
+        input_names = list(tokenizer.model_input_names)
+        # Graphs exported without one of them are exported again
+        if onnx_backend.exported_inputs(path) != input_names:
+            _, model = self.load(static_dir, 'cpu')
+            sample = tokenizer(['an entity description', 'a longer entity description, padded'],
+                               padding=True, return_tensors='pt')
+            onnx_backend.export(onnx_backend.LastHiddenState(model, input_names), path,
+                                'last_hidden_state', {0: 'batch', 1: 'sequence'},
+                                input_names, check_inputs=sample)
+        session = onnx_backend.create_session(path, device, threads)
+        return tokenizer, onnx_backend.OnnxEncoder(session)
+
+
+class SentenceTransformerVectorizer(Vectorizer):
+    """A sentence-transformers model."""
+
+    kind = 'sentence_transformer'
+
+    def load(self, static_dir, device='cpu'):
+        torch = lazy_import('torch')
+        sentence_transformers = lazy_import('sentence_transformers')
+        return sentence_transformers.SentenceTransformer(self.revision,
+                                                         device=torch.device(device))
+
+    def load_onnx(self, static_dir, device='cpu', threads=None):
+        onnx_backend = lazy_import('onnx_backend')
+        path = self.onnx_path(static_dir)
+        # The torch model is kept for its tokenizer
+        model = self.load(static_dir, 'cpu')
+        if not os.path.exists(path):
+            onnx_backend.export(onnx_backend.SentenceEmbedding(model), path,
+                                'sentence_embedding', {0: 'batch'})
+        session = onnx_backend.create_session(path, device, threads)
+        return onnx_backend.OnnxSentenceTransformer(session, model)
+
+
+plugins = {}
+
+
+def register(plugin):
+    """Adds `plugin` to the registry, replacing any plugin with its name."""
+    plugins[plugin.name] = plugin
+    return plugin
+
+
+def get_vectorizer(name):
+    if name not in plugins:
+        raise ValueError(f'Unknown vectorizer: {name}')
+    return plugins[name]
+
+
+def timing_report(module_import_time, init_time):
+    """
+    Returns the cold-start time of a run: the import of vectorization, the
+    first import of every heavy dependency so far, and the model load.
+    """
+    imports = dict(import_times)
+    return {'module_import': module_import_time, 'imports': imports,
+            'init_time': init_time,
+            'total': module_import_time + sum(imports.values()) + init_time}
+
+
+register(StaticVectorizer('word2vec', 'word2vec-google-news-300', 300, 'whitespace',
+                          'load_word2vec'))
+register(StaticVectorizer('fasttext', 'wiki.en.bin', 300, 'char-ngram', 'load_fasttext'))
+
+register(TransformerVectorizer('bert', 'bert-base-uncased', 768, 'wordpiece',
+                               'BertTokenizerFast', 'BertModel'))
+register(TransformerVectorizer('distilbert', 'distilbert-base-uncased', 768, 'wordpiece',
+                               'DistilBertTokenizerFast', 'DistilBertModel'))
+register(TransformerVectorizer('roberta', 'roberta-base', 768, 'bpe',
+                               'RobertaTokenizerFast', 'RobertaModel'))
+register(TransformerVectorizer('xlnet', 'xlnet-base-cased', 768, 'sentencepiece',
+                               'XLNetTokenizerFast', 'XLNetModel', cls_position='last'))
+register(TransformerVectorizer('albert', 'albert-base-v2', 768, 'sentencepiece',
+                               'AlbertTokenizerFast', 'AlbertModel'))
+
+register(SentenceTransformerVectorizer('smpnet', 'all-mpnet-base-v2', 768, 'wordpiece', 384))
+register(SentenceTransformerVectorizer('st5', 'gtr-t5-base', 768, 'sentencepiece', 512))
+register(SentenceTransformerVectorizer('sdistilroberta', 'all-distilroberta-v1', 768, 'bpe', 512))
+register(SentenceTransformerVectorizer('sminilm', 'all-MiniLM-L6-v2', 384, 'wordpiece', 256))
+register(SentenceTransformerVectorizer('glove', 'average_word_embeddings_glove.6B.300d', 300,
+                                       'whitespace'))